@@ -0,0 +1,176 @@
+import asyncio
+import hashlib
+import json
+import random
+import re
+from pathlib import Path
+
+import numpy as np
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+# === Local stand-ins for Cohere, Supabase and Chutes ===
+# Each fake adds configurable latency, jitter, an error rate and a slow tail
+# (slow_rate of the calls take slow_factor times longer) so load tests
+# exercise the real request path without spending API credits.
+#
+# Embeddings are a signed feature hash of the words in the text, so queries
+# and chunks that share vocabulary really are close in cosine similarity.
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+DOCTORS = ["sinclair", "longo", "huberman", "barzilai", "de_grey", "campisi"]
+DIM = 1024
+
+
+class Profile:
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, slow_rate=0.0, slow_factor=10.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.slow_rate = slow_rate
+        self.slow_factor = slow_factor
+
+    async def delay(self, scale=1.0):
+        seconds = self.latency + random.uniform(-self.jitter, self.jitter)
+        if random.random() < self.slow_rate:
+            seconds *= self.slow_factor
+        if seconds > 0:
+            await asyncio.sleep(seconds * scale)
+
+    def should_fail(self):
+        return random.random() < self.error_rate
+
+
+def fake_embedding(text, dim=DIM):
+    vector = np.zeros(dim, dtype=np.float32)
+    for token in re.findall(r"\w+", text.lower()):
+        h = int.from_bytes(hashlib.blake2b(token.encode(), digest_size=8).digest(), "little")
+        vector[h % dim] += 1.0 if (h >> 63) == 0 else -1.0
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+# === Corpus: health_reports/*.md paragraphs plus Sinclair's PDF chunks ===
+def load_corpus():
+    corpus = {}
+    for doctor in DOCTORS:
+        rows = []
+        md_file = REPO_ROOT / "health_reports" / f"{doctor}.md"
+        if md_file.exists():
+            title = "Introduction"
+            for block in md_file.read_text(encoding="utf-8").split("\n\n"):
+                block = block.strip()
+                if block.startswith("#"):
+                    title = block.splitlines()[0].lstrip("#").strip()
+                    block = "\n".join(block.splitlines()[1:]).strip()
+                if len(block) > 50:
+                    rows.append({"title": title, "text": block})
+        if doctor == "sinclair":
+            json_file = REPO_ROOT / "Sinclair" / "sinclair_chunks.json"
+            if json_file.exists():
+                for chunk in json.loads(json_file.read_text()):
+                    rows.append({"title": f"Page {chunk['page']}", "text": chunk["text"]})
+        for i, row in enumerate(rows):
+            row["id"] = f"{doctor}-{i}"
+        corpus[doctor] = {
+            "rows": rows,
+            "vectors": np.stack([fake_embedding(r["text"]) for r in rows]) if rows else np.zeros((0, DIM)),
+        }
+    return corpus
+
+
+def corpus_vocabulary(corpus, min_length=5):
+    words = set()
+    for data in corpus.values():
+        for row in data["rows"]:
+            words.update(w for w in re.findall(r"[a-z]+", row["text"].lower()) if len(w) >= min_length)
+    return sorted(words)
+
+
+# === Cohere: POST /v1/embed ===
+def cohere_app(profile):
+    app = FastAPI()
+
+    @app.post("/v1/embed")
+    async def embed(request: Request):
+        body = await request.json()
+        await profile.delay()
+        if profile.should_fail():
+            return JSONResponse({"message": "fake cohere error"}, status_code=500)
+        texts = body.get("texts") or []
+        return {
+            "id": "fake",
+            "texts": texts,
+            "embeddings": [fake_embedding(t).tolist() for t in texts],
+            "response_type": "embeddings_floats",
+        }
+
+    return app
+
+
+# === Supabase: POST /rest/v1/rpc/match_<doctor>_chunks, GET /rest/v1/<doctor>_chunks ===
+def supabase_app(profile, corpus):
+    app = FastAPI()
+
+    @app.post("/rest/v1/rpc/{function_name}")
+    async def match(function_name: str, request: Request):
+        body = await request.json()
+        await profile.delay()
+        if profile.should_fail():
+            return JSONResponse({"message": "fake supabase error"}, status_code=500)
+
+        doctor = function_name.removeprefix("match_").removesuffix("_chunks")
+        data = corpus.get(doctor)
+        if data is None:
+            return JSONResponse({"message": f"function {function_name} not found"}, status_code=404)
+
+        query = np.asarray(body["query_embedding"], dtype=np.float32)
+        query /= np.linalg.norm(query) or 1.0
+        scores = data["vectors"] @ query
+        best = np.argsort(-scores)[: int(body.get("match_count", 5))]
+        return [{**data["rows"][i], "similarity": float(scores[i])} for i in best]
+
+    @app.get("/rest/v1/{table}")
+    async def select(table: str, limit: int = 1000, offset: int = 0):
+        await profile.delay()
+        data = corpus.get(table.removesuffix("_chunks"))
+        if data is None:
+            return JSONResponse({"message": f"relation {table} not found"}, status_code=404)
+        return [
+            {**row, "embedding": json.dumps(vector.tolist())}
+            for row, vector in zip(data["rows"][offset:offset + limit], data["vectors"][offset:offset + limit])
+        ]
+
+    return app
+
+
+# === Chutes: OpenAI-compatible POST /v1/chat/completions (plain and stream) ===
+ANSWER_TOKENS = ("Based on the research, " + "this is a fake generated answer token " * 12).split(" ")
+
+
+def chutes_app(profile, tokens_per_second=50.0):
+    app = FastAPI()
+
+    @app.post("/v1/chat/completions")
+    async def completions(request: Request):
+        body = await request.json()
+        if profile.should_fail():
+            await profile.delay(0.1)
+            return JSONResponse({"error": "fake chutes error"}, status_code=500)
+
+        if not body.get("stream"):
+            await profile.delay()
+            return {"choices": [{"message": {"role": "assistant", "content": " ".join(ANSWER_TOKENS)}}]}
+
+        async def events():
+            # Time to first token is a fraction of the profile latency
+            await profile.delay(0.2)
+            for token in ANSWER_TOKENS:
+                chunk = {"choices": [{"delta": {"content": token + " "}}]}
+                yield f"data: {json.dumps(chunk)}\n\n"
+                await asyncio.sleep(1.0 / tokens_per_second)
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    return app
@@ -0,0 +1,255 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import httpx
+import numpy as np
+import uvicorn
+
+from fake_upstreams import (
+    DOCTORS, Profile, chutes_app, cohere_app, corpus_vocabulary, load_corpus, supabase_app,
+)
+
+# === Offline load test for yomo_backend/main.py ===
+# Starts local fake Cohere / Supabase / Chutes servers, launches the API
+# against them with uvicorn (or targets an already running --target), then
+# drives it with a closed-loop load generator and reports throughput,
+# p50/p95/p99 latency and error rate per scenario:
+#
+#   cold   every question is new: full embed → search → generate path
+#   hot    a small pool of questions, pre-warmed: answer-cache path
+#   mixed  80% from the hot pool, 20% new
+#
+# Example:
+#   python bench/load_test.py --requests 500 --concurrency 50 \
+#       --chutes-latency 2 --chutes-jitter 0.5 --json before.json
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def serve_in_thread(app, port):
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.01)
+    return server
+
+
+def start_api(port, env_overrides, workers):
+    tmp = tempfile.mkdtemp(prefix="yomo-bench-")
+    env = {
+        **os.environ,
+        "EMBED_CACHE_PATH": os.path.join(tmp, "embed_cache.sqlite3"),
+        "ANSWER_CACHE_PATH": os.path.join(tmp, "answer_cache.sqlite3"),
+        "QUERY_LOG_PATH": os.path.join(tmp, "query_log.jsonl"),
+        "SLOW_LOG_PATH": os.path.join(tmp, "slow_requests.jsonl"),
+        "LOCAL_INDEX_DIR": os.path.join(tmp, "indexes"),
+        "WEB_CONCURRENCY": str(workers),
+        **env_overrides,
+    }
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1",
+         "--port", str(port), "--workers", str(workers), "--log-level", "warning"],
+        cwd=REPO_ROOT / "yomo_backend",
+        env=env,
+    )
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("API process exited during startup")
+        try:
+            # /ready, not /health: measure a warmed-up API, as a deploy would route to
+            if httpx.get(f"{url}/ready", timeout=1).status_code == 200:
+                return process, url
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError("API did not become ready within 60s")
+
+
+# === Workload ===
+def random_question(rng, vocabulary):
+    return "What do you think about " + " ".join(rng.sample(vocabulary, 6)) + "?"
+
+
+def build_workload(scenario, n, rng, vocabulary, hot_pool):
+    items = []
+    for _ in range(n):
+        if scenario == "hot" or (scenario == "mixed" and rng.random() < 0.8):
+            items.append(rng.choice(hot_pool))
+        else:
+            items.append({"question": random_question(rng, vocabulary), "doctor": rng.choice(DOCTORS)})
+    return items
+
+
+async def send(client, endpoint, item, top_k):
+    payload = {**item, "top_k": top_k}
+    start = time.perf_counter()
+    ttft = None
+    try:
+        if endpoint == "/ask/stream":
+            async with client.stream("POST", endpoint, json=payload) as res:
+                ok = res.status_code == 200
+                async for line in res.aiter_lines():
+                    if line.startswith("event: token") and ttft is None:
+                        ttft = time.perf_counter() - start
+                    elif line.startswith("event: error"):
+                        ok = False
+        else:
+            res = await client.post(endpoint, json=payload)
+            ok = res.status_code == 200
+    except httpx.HTTPError:
+        ok = False
+    return time.perf_counter() - start, ok, ttft
+
+
+async def run_scenario(url, endpoint, items, concurrency, top_k):
+    queue = asyncio.Queue()
+    for item in items:
+        queue.put_nowait(item)
+    samples = []
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=120) as client:
+        async def worker():
+            while not queue.empty():
+                samples.append(await send(client, endpoint, queue.get_nowait(), top_k))
+
+        start = time.perf_counter()
+        await asyncio.gather(*[worker() for _ in range(concurrency)])
+        elapsed = time.perf_counter() - start
+
+    latencies = np.array([s[0] for s in samples]) * 1000
+    ttfts = np.array([s[2] for s in samples if s[2] is not None]) * 1000
+    errors = sum(1 for s in samples if not s[1])
+    report = {
+        "requests": len(samples),
+        "errors": errors,
+        "error_rate": errors / len(samples) if samples else 0.0,
+        "throughput_rps": len(samples) / elapsed if elapsed else 0.0,
+        "p50_ms": float(np.percentile(latencies, 50)) if len(latencies) else None,
+        "p95_ms": float(np.percentile(latencies, 95)) if len(latencies) else None,
+        "p99_ms": float(np.percentile(latencies, 99)) if len(latencies) else None,
+    }
+    if len(ttfts):
+        report["ttft_p50_ms"] = float(np.percentile(ttfts, 50))
+        report["ttft_p95_ms"] = float(np.percentile(ttfts, 95))
+    return report
+
+
+def print_report(results):
+    print(f"\n{'scenario':<8} {'reqs':>6} {'err%':>6} {'rps':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for name, r in results.items():
+        print(
+            f"{name:<8} {r['requests']:>6} {r['error_rate'] * 100:>6.2f} {r['throughput_rps']:>8.1f}"
+            f" {r['p50_ms']:>9.1f} {r['p95_ms']:>9.1f} {r['p99_ms']:>9.1f}"
+            + (f"   ttft p50 {r['ttft_p50_ms']:.1f} ms" if "ttft_p50_ms" in r else "")
+        )
+
+
+async def main(args):
+    rng = random.Random(args.seed)
+    corpus = load_corpus()
+    vocabulary = corpus_vocabulary(corpus)
+
+    servers, api = [], None
+    try:
+        if args.target:
+            url = args.target
+        else:
+            ports = {name: free_port() for name in ("cohere", "supabase", "chutes", "api")}
+            servers.append(serve_in_thread(
+                cohere_app(Profile(
+                    args.cohere_latency, args.cohere_jitter, args.cohere_error_rate,
+                    args.cohere_slow_rate, args.cohere_slow_factor,
+                )),
+                ports["cohere"],
+            ))
+            servers.append(serve_in_thread(
+                supabase_app(Profile(
+                    args.supabase_latency, args.supabase_jitter, args.supabase_error_rate,
+                    args.supabase_slow_rate, args.supabase_slow_factor,
+                ), corpus),
+                ports["supabase"],
+            ))
+            servers.append(serve_in_thread(
+                chutes_app(Profile(
+                    args.chutes_latency, args.chutes_jitter, args.chutes_error_rate,
+                    args.chutes_slow_rate, args.chutes_slow_factor,
+                )),
+                ports["chutes"],
+            ))
+            env = {
+                "COHERE_API_KEY": "bench",
+                "COHERE_BASE_URL": f"http://127.0.0.1:{ports['cohere']}",
+                "SUPABASE_URL": f"http://127.0.0.1:{ports['supabase']}",
+                "SUPABASE_SERVICE_ROLE_KEY": "bench",
+                "CHUTES_URL": f"http://127.0.0.1:{ports['chutes']}/v1/chat/completions",
+                "CHUTES_API_KEY": "bench",
+            }
+            env.update(dict(kv.split("=", 1) for kv in args.env))
+            api, url = start_api(ports["api"], env, args.workers)
+
+        hot_pool = [
+            {"question": random_question(rng, vocabulary), "doctor": rng.choice(DOCTORS)}
+            for _ in range(args.hot_set)
+        ]
+        results = {}
+        for scenario in args.scenarios.split(","):
+            if scenario in ("hot", "mixed"):
+                # Warm the answer cache for the hot pool; not measured
+                await run_scenario(url, args.endpoint, hot_pool, args.concurrency, args.top_k)
+            items = build_workload(scenario, args.requests, rng, vocabulary, hot_pool)
+            results[scenario] = await run_scenario(url, args.endpoint, items, args.concurrency, args.top_k)
+            print(f"✅ {scenario}: {json.dumps(results[scenario])}")
+
+        print_report(results)
+        if args.json:
+            with open(args.json, "w") as f:
+                json.dump({"args": vars(args), "results": results}, f, indent=2)
+    finally:
+        if api is not None:
+            api.terminate()
+            api.wait(10)
+        for server in servers:
+            server.should_exit = True
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline load test against local upstream stand-ins")
+    parser.add_argument("--scenarios", default="cold,hot,mixed")
+    parser.add_argument("--endpoint", default="/ask", choices=["/ask", "/ask/stream"])
+    parser.add_argument("--requests", type=int, default=200, help="Measured requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--hot-set", type=int, default=20, help="Distinct questions in the hot pool")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn workers for the API")
+    parser.add_argument("--target", help="Benchmark an already running API instead of starting one")
+    parser.add_argument("--env", action="append", default=[], help="Extra KEY=VALUE for the API process")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="Write the results to this file")
+    for service, latency in (("cohere", 0.15), ("supabase", 0.05), ("chutes", 3.0)):
+        parser.add_argument(f"--{service}-latency", type=float, default=latency, help="Seconds")
+        parser.add_argument(f"--{service}-jitter", type=float, default=latency / 4, help="Seconds")
+        parser.add_argument(f"--{service}-error-rate", type=float, default=0.0)
+        parser.add_argument(f"--{service}-slow-rate", type=float, default=0.0, help="Share of calls in the slow tail")
+        parser.add_argument(f"--{service}-slow-factor", type=float, default=10.0, help="Latency multiplier of the slow tail")
+    asyncio.run(main(parser.parse_args()))
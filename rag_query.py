@@ -5,8 +5,9 @@ import cohere
 import requests
 from dotenv import load_dotenv
 from fastapi.middleware.cors import CORSMiddleware
-from typing import Dict
 import hashlib
+from yomo_backend.cache import AnswerCache
+from yomo_backend.embed_cache import EmbeddingCache
 
 # === Load environment variables ===
 load_dotenv()
@@ -27,8 +28,15 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# === In-memory cache ===
-cache: Dict[str, Dict] = {}
+# === In-memory cache (bounded LRU with TTL) ===
+cache = AnswerCache(
+    max_entries=int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "2048")),
+    ttl=float(os.getenv("ANSWER_CACHE_TTL", "86400")),
+    stale_ttl=0,
+)
+
+# === Persistent query-embedding cache (shared with the API) ===
+embed_cache = EmbeddingCache()
 
 # === Request schema ===
 class QuestionRequest(BaseModel):
@@ -42,12 +50,18 @@ def root():
 
 # === Embed question ===
 def embed_query(query):
+    cached = embed_cache.get(query, "embed-english-v3.0", "search_query")
+    if cached is not None:
+        return cached
+
     response = co.embed(
         texts=[query],
         model="embed-english-v3.0",
         input_type="search_query"
     )
-    return response.embeddings[0]
+    embedding = response.embeddings[0]
+    embed_cache.set(query, "embed-english-v3.0", "search_query", embedding)
+    return embedding
 
 # === Supabase query for similar chunks ===
 def search_supabase(query_embedding, doctor, top_k):
@@ -106,8 +120,9 @@ def ask_question(request: QuestionRequest):
     try:
         # Cache key (hash of question + doctor)
         key = hashlib.sha256(f"{request.doctor}|{request.question}".encode()).hexdigest()
-        if key in cache:
-            return cache[key]
+        cached, _ = cache.get(key)
+        if cached is not None:
+            return cached
 
         query_embedding = embed_query(request.question)
         chunks = search_supabase(query_embedding, request.doctor, request.top_k)
@@ -117,7 +132,7 @@ def ask_question(request: QuestionRequest):
         result = {"answer": answer, "sources": sources}
 
         # Save to cache
-        cache[key] = result
+        cache.set(key, result)
 
         # Save to log
         with open("query_log.txt", "a") as log_file:
@@ -3,6 +3,8 @@ import requests
 import cohere
 from dotenv import load_dotenv
 from pathlib import Path
+from yomo_backend.embed_cache import EmbeddingCache
+from yomo_backend.resilience import call_sync, check_status, timeouts
 
 # === Load env ===
 env_path = Path("yomo_backend/.env")
@@ -12,7 +14,10 @@ SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
 COHERE_KEY = os.getenv("COHERE_API_KEY")
 
-co = cohere.Client(COHERE_KEY)
+co = cohere.Client(COHERE_KEY, timeout=timeouts("cohere")[1], max_retries=0)
+
+# === Persistent query-embedding cache (shared with the API) ===
+embed_cache = EmbeddingCache()
 
 headers = {
     "apikey": SUPABASE_KEY,
@@ -22,13 +27,16 @@ headers = {
 
 # === Search a specific table ===
 def search_doctor_chunks(query, table_name="sinclair_chunks", match_function="match_sinclair_chunks", top_k=5):
-    # Step 1: Get query embedding
-    embed_response = co.embed(
-        texts=[query],
-        model="embed-english-v3.0",
-        input_type="search_query"
-    )
-    query_embedding = embed_response.embeddings[0]
+    # Step 1: Get query embedding (from the local cache when we have seen it)
+    query_embedding = embed_cache.get(query, "embed-english-v3.0", "search_query")
+    if query_embedding is None:
+        embed_response = call_sync("cohere", lambda: co.embed(
+            texts=[query],
+            model="embed-english-v3.0",
+            input_type="search_query"
+        ))
+        query_embedding = embed_response.embeddings[0]
+        embed_cache.set(query, "embed-english-v3.0", "search_query", query_embedding)
 
     # Step 2: POST to Supabase RPC function
     rpc_url = f"{SUPABASE_URL}/rest/v1/rpc/{match_function}"
@@ -37,7 +45,9 @@ def search_doctor_chunks(query, table_name="sinclair_chunks", match_function="ma
         "match_count": top_k
     }
 
-    res = requests.post(rpc_url, headers=headers, json=payload)
+    res = call_sync("supabase", lambda: check_status("supabase", requests.post(
+        rpc_url, headers=headers, json=payload, timeout=timeouts("supabase")
+    )))
 
     if res.status_code != 200:
         print(f"❌ Error: {res.status_code} - {res.text}")
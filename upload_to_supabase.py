@@ -1,12 +1,20 @@
 import os
 import re
+import hashlib
+import argparse
+import time
 import uuid
+import threading
 import requests
 import cohere
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from requests.adapters import HTTPAdapter
 from tqdm import tqdm
 from pathlib import Path
 from dotenv import load_dotenv
 import json
+from yomo_backend.tokens import count_tokens
+from yomo_backend.resilience import call_sync, check_status, retry_after_seconds, status_of, timeouts
 
 # === Load credentials from yomo_backend/.env ===
 env_path = Path("yomo_backend/.env")
@@ -16,8 +24,28 @@ SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
 COHERE_KEY = os.getenv("COHERE_API_KEY")
 
-# === Init Cohere client ===
-co = cohere.Client(COHERE_KEY)
+# === Bulk ingestion settings ===
+EMBED_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "96"))  # Cohere's per-call maximum
+INGEST_CONCURRENCY = int(os.getenv("INGEST_CONCURRENCY", "4"))
+COHERE_CALLS_PER_SEC = float(os.getenv("COHERE_CALLS_PER_SEC", "5"))
+SUPABASE_CALLS_PER_SEC = float(os.getenv("SUPABASE_CALLS_PER_SEC", "20"))
+MAX_RETRIES = 6
+MANIFEST_PATH = os.getenv("INGEST_MANIFEST", "ingest_manifest.json")
+DELETE_BATCH_SIZE = 100
+
+# Send per-chunk token counts with the rows; the table needs the column:
+#   alter table <doctor>_chunks add column token_count int;
+STORE_TOKEN_COUNTS = os.getenv("STORE_TOKEN_COUNTS", "false").lower() == "true"
+
+# Namespace for deterministic chunk UUIDs (uuid5 of doctor|section|content hash)
+CHUNK_NAMESPACE = uuid.UUID("6f2b7c1e-3d4a-5b8c-9e0f-1a2b3c4d5e6f")
+
+# === Per-service (connect, read) timeouts, see yomo_backend/resilience.py ===
+COHERE_TIMEOUT = timeouts("cohere")
+SUPABASE_TIMEOUT = timeouts("supabase")
+
+# === Init Cohere client (retries are ours, below) ===
+co = cohere.Client(COHERE_KEY, timeout=COHERE_TIMEOUT[1], max_retries=0)
 
 headers = {
     "apikey": SUPABASE_KEY,
@@ -26,6 +54,60 @@ headers = {
     "Prefer": "return=minimal"  # Add this to ensure proper response handling
 }
 
+# === Deterministic chunk IDs ===
+def content_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def chunk_id(doctor, title, text, occurrence=0):
+    key = f"{doctor}|{title}|{content_hash(text)}"
+    if occurrence:
+        key += f"|{occurrence}"  # identical paragraphs repeated within a section
+    return str(uuid.uuid5(CHUNK_NAMESPACE, key))
+
+def assign_chunk_ids(chunks):
+    seen = {}
+    for chunk in chunks:
+        key = (chunk["title"], chunk["text"])
+        occurrence = seen.get(key, 0)
+        seen[key] = occurrence + 1
+        chunk["id"] = chunk_id(chunk["doctor"], chunk["title"], chunk["text"], occurrence)
+        chunk["hash"] = content_hash(chunk["text"])
+        chunk["token_count"] = count_tokens(chunk["text"])
+    return chunks
+
+# === Local manifest of what has been embedded and uploaded, per table ===
+class Manifest:
+    def __init__(self, path=MANIFEST_PATH):
+        self.path = path
+        self.lock = threading.Lock()
+        self.tables = {}
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                self.tables = json.load(f)
+
+    def entries(self, table):
+        return self.tables.get(table)
+
+    def add(self, table, chunks):
+        with self.lock:
+            entries = self.tables.setdefault(table, {})
+            for chunk in chunks:
+                entries[chunk["id"]] = {"title": chunk.get("title"), "hash": chunk.get("hash")}
+            self._save()
+
+    def remove(self, table, ids):
+        with self.lock:
+            entries = self.tables.setdefault(table, {})
+            for chunk_id in ids:
+                entries.pop(chunk_id, None)
+            self._save()
+
+    def _save(self):
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.tables, f, indent=1, sort_keys=True)
+        os.replace(tmp, self.path)
+
 # === Extract hyperlinks from markdown ===
 def extract_links(text):
     return re.findall(r'\[.*?\]\((.*?)\)', text)
@@ -51,7 +133,6 @@ def split_markdown(md_text, doctor):
     # Process the initial section if it exists
     if sections[0].strip():
         chunks.append({
-            "id": str(uuid.uuid4()),
             "doctor": doctor,
             "title": "Introduction",
             "text": sections[0].strip(),
@@ -71,13 +152,14 @@ def split_markdown(md_text, doctor):
             for para in paragraphs:
                 if len(para.strip()) > 50:  # Only create chunks for substantial paragraphs
                     chunks.append({
-                        "id": str(uuid.uuid4()),
                         "doctor": doctor,
                         "title": header,
                         "text": para.strip(),
                         "sources": []
                     })
     
+    assign_chunk_ids(chunks)
+
     print(f"Created {len(chunks)} chunks")
     if chunks:
         print("First chunk preview:")
@@ -88,91 +170,224 @@ def split_markdown(md_text, doctor):
     return chunks
 
 
-# === Upload chunks to Supabase in batches ===
-def upload_chunks(md_file, doctor, supabase_table, batch_size=10):
+# === Adaptive rate limiter (AIMD) ===
+# Spaces calls at `rate` per second across threads. A 429 halves the rate and
+# pauses everyone for the suggested delay; each success creeps back up.
+# call() wraps one attempt, so it composes with resilience.call_sync's
+# retries: every retry waits for its slot and reports back.
+class RateLimiter:
+    def __init__(self, rate, min_rate=0.2, throttle_statuses=(429,)):
+        self.max_rate = rate
+        self.min_rate = min_rate
+        self.rate = rate
+        self.throttle_statuses = throttle_statuses
+        self.next_at = 0.0
+        self.lock = threading.Lock()
+
+    def call(self, fn):
+        self.acquire()
+        try:
+            result = fn()
+        except Exception as e:
+            if status_of(e) in self.throttle_statuses:
+                self.throttled(retry_after_seconds(e))
+            raise
+        self.succeeded()
+        return result
+
+    def acquire(self):
+        with self.lock:
+            now = time.monotonic()
+            wait = max(0.0, self.next_at - now)
+            self.next_at = max(now, self.next_at) + 1.0 / self.rate
+        if wait:
+            time.sleep(wait)
+
+    def throttled(self, retry_after=None):
+        with self.lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+            pause = retry_after if retry_after is not None else 1.0 / self.rate
+            self.next_at = max(self.next_at, time.monotonic() + pause)
+
+    def succeeded(self):
+        with self.lock:
+            self.rate = min(self.max_rate, self.rate + 0.1 * self.max_rate)
+
+
+cohere_limiter = RateLimiter(COHERE_CALLS_PER_SEC)
+supabase_limiter = RateLimiter(SUPABASE_CALLS_PER_SEC, throttle_statuses=(429, 503))
+
+
+# === Pooled Supabase session ===
+def make_session(pool_size=INGEST_CONCURRENCY):
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers.update(headers)
+    return session
+
+
+# === Embed one batch (up to 96 texts per Cohere call) ===
+# Timeouts, dropped connections, 429 and 5xx are retried (resilience.call_sync).
+# The breaker counts batches that fail after all retries; once open it fails
+# batches at once (the manifest makes the next run pick them up).
+def embed_documents(texts):
+    response = call_sync("cohere", lambda: cohere_limiter.call(lambda: co.embed(
+        texts=texts,
+        model="embed-english-v3.0",
+        input_type="search_document"
+    )), attempts=MAX_RETRIES)
+    return response.embeddings
+
+
+# === Supabase request with rate limiting, timeouts and 429/5xx backoff ===
+def supabase_request(session, method, url, **kwargs):
+    res = call_sync("supabase", lambda: supabase_limiter.call(
+        lambda: check_status("supabase", session.request(method, url, timeout=SUPABASE_TIMEOUT, **kwargs))
+    ), attempts=MAX_RETRIES)
+    if res.status_code in (200, 201, 204):
+        return res
+    raise Exception(f"Supabase {method} error {res.status_code}: {res.text}")
+
+# === Upsert one batch of rows as a single PostgREST array payload ===
+def insert_rows(session, supabase_table, rows):
+    supabase_request(
+        session, "POST", f"{SUPABASE_URL}/rest/v1/{supabase_table}",
+        json=rows,
+        params={"on_conflict": "id"},
+        headers={"Prefer": "resolution=merge-duplicates,return=minimal"},
+    )
+
+def delete_rows(session, supabase_table, ids):
+    for i in range(0, len(ids), DELETE_BATCH_SIZE):
+        batch = ids[i:i + DELETE_BATCH_SIZE]
+        supabase_request(
+            session, "DELETE", f"{SUPABASE_URL}/rest/v1/{supabase_table}",
+            params={"id": f"in.({','.join(batch)})"},
+        )
+
+def fetch_remote_ids(session, supabase_table, page_size=1000):
+    ids = []
+    while True:
+        res = supabase_request(
+            session, "GET", f"{SUPABASE_URL}/rest/v1/{supabase_table}",
+            params={"select": "id", "order": "id", "limit": str(page_size), "offset": str(len(ids))},
+        )
+        page = res.json()
+        ids.extend(str(row["id"]) for row in page)
+        if len(page) < page_size:
+            return ids
+
+
+def upload_batch(session, supabase_table, batch, manifest=None):
+    embeddings = embed_documents([c["text"] for c in batch])
+    rows = [
+        {
+            "id": chunk["id"],
+            "doctor": chunk["doctor"],
+            "title": chunk["title"],
+            "text": chunk["text"],
+            "embedding": list(embedding),
+            "sources": chunk.get("sources", []),
+            **({"token_count": chunk["token_count"]} if STORE_TOKEN_COUNTS else {}),
+        }
+        for chunk, embedding in zip(batch, embeddings)
+    ]
+    insert_rows(session, supabase_table, rows)
+    if manifest is not None:
+        manifest.add(supabase_table, batch)
+    return len(rows)
+
+
+# === Sync chunks to Supabase ===
+# Only chunks whose deterministic ID is not in the manifest are embedded and
+# upserted (in concurrent, bulk batches); IDs that disappeared from the file
+# are deleted. Without a manifest entry for the table, the IDs already in
+# Supabase are used as the baseline, so rows from older uploads get cleaned up.
+# `full=True` re-embeds and upserts everything.
+def upload_chunks(md_file, doctor, supabase_table, batch_size=EMBED_BATCH_SIZE,
+                  concurrency=INGEST_CONCURRENCY, session=None, manifest=None, full=False):
     if not os.path.exists(md_file):
         print(f"❌ File not found: {md_file}")
-        return
+        return 0
 
     try:
         with open(md_file, "r", encoding="utf-8") as f:
             md_text = f.read()
     except Exception as e:
         print(f"❌ Error reading file {md_file}: {str(e)}")
-        return
+        return 0
 
     # Check if file is empty
     if not md_text.strip():
         print(f"❌ File {md_file} is empty")
-        return
+        return 0
 
     chunks = split_markdown(md_text, doctor)
     print(f"🔹 {doctor}: {len(chunks)} chunks parsed")
-    
-    # Debug: Print the first few characters of the markdown file to verify content
-    print(f"📄 First 100 chars of {md_file}: {md_text[:100]}")
-    
-    # Debug: Check if the file path is correct
-    print(f"📂 File path: {os.path.abspath(md_file)}")
-    
+
     # If no chunks were parsed, exit early
     if not chunks:
         print(f"⚠️ No chunks were parsed for {doctor}. Check if the markdown format is correct.")
-        return
-
+        return 0
+
+    session = session or make_session(concurrency)
+    manifest = manifest or Manifest()
+
+    known = manifest.entries(supabase_table)
+    current_ids = {c["id"] for c in chunks}
+    if known is None:
+        known = dict.fromkeys(fetch_remote_ids(session, supabase_table))
+        # Record what Supabase already holds: the next run then neither
+        # re-embeds the unchanged chunks nor forgets the stale rows (if
+        # deleting them is skipped or fails below)
+        manifest.add(supabase_table, [c for c in chunks if c["id"] in known] + [
+            {"id": chunk_id} for chunk_id in known if chunk_id not in current_ids
+        ])
+    removed = [chunk_id for chunk_id in known if chunk_id not in current_ids]
+    changed = chunks if full else [c for c in chunks if c["id"] not in known]
+    print(f"🔁 {doctor}: {len(changed)} new/changed, {len(removed)} removed, "
+          f"{len(chunks) - len(changed)} unchanged")
+
+    batches = [changed[i:i + batch_size] for i in range(0, len(changed), batch_size)]
     failed_chunks = []
-
-    for i in tqdm(range(0, len(chunks), batch_size), desc=f"Uploading {doctor}"):
-        batch = chunks[i:i + batch_size]
-        texts = [c["text"] for c in batch]
-
+    uploaded = 0
+    start = time.perf_counter()
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        futures = {
+            pool.submit(upload_batch, session, supabase_table, batch, manifest): batch
+            for batch in batches
+        }
+        for future in tqdm(as_completed(futures), total=len(futures), desc=f"Uploading {doctor}"):
+            batch = futures[future]
+            try:
+                uploaded += future.result()
+            except Exception as e:
+                print(f"❌ Batch failed: {str(e)}")
+                failed_chunks.extend(c["id"] for c in batch)
+
+    # Delete removed chunks only after their replacements are in place; after a
+    # failed batch they stay in the manifest and the next run deletes them
+    if removed and failed_chunks:
+        print(f"⏭️ Keeping {len(removed)} removed chunks until every batch has uploaded")
+    elif removed:
         try:
-            response = co.embed(
-                texts=texts,
-                model="embed-english-v3.0",
-                input_type="search_document"
-            )
-            embeddings = response.embeddings
-
-            for j, chunk in enumerate(batch):
-                # Format the embedding array properly for PostgreSQL
-                embedding_array = list(embeddings[j])  # Convert to regular list
-                
-                payload = {
-                    "id": chunk["id"],
-                    "doctor": chunk["doctor"],
-                    "title": chunk["title"],
-                    "text": chunk["text"],
-                    "embedding": embedding_array,  # Send as regular array
-                    "sources": chunk.get("sources", [])  # Ensure sources is always a list
-                }
-
-                # Debug print
-                print(f"\nSending payload for chunk {i+j}:")
-                print(f"ID: {payload['id']}")
-                print(f"Embedding length: {len(payload['embedding'])}")
-
-                res = requests.post(
-                    f"{SUPABASE_URL}/rest/v1/{supabase_table}",
-                    headers=headers,
-                    json=payload
-                )
-
-                if res.status_code != 201:
-                    print(f"❌ Error details: {res.text}")
-                    failed_chunks.append(chunk["id"])
-                else:
-                    print(f"✅ Successfully uploaded chunk {i+j}")
-
+            delete_rows(session, supabase_table, removed)
+            manifest.remove(supabase_table, removed)
         except Exception as e:
-            print(f"❌ Error during processing: {str(e)}")
-            failed_chunks.extend([c["id"] for c in batch])
+            print(f"❌ Deleting {len(removed)} removed chunks failed: {str(e)}")
+
+    elapsed = time.perf_counter() - start
+    print(f"⏱️ {doctor}: {uploaded} rows in {elapsed:.1f}s ({uploaded / elapsed if elapsed else 0:.1f} rows/sec)")
 
     if failed_chunks:
         print(f"⚠️ {len(failed_chunks)} chunks failed for {doctor}")
         print(f"Failed chunk IDs: {failed_chunks[:5]}...")
     else:
         print(f"✅ {doctor} upload completed successfully")
+    return uploaded
 
 
 def embed_query(query):
@@ -200,11 +415,17 @@ def search_supabase(query_embedding, top_k):
 
 # === Bulk upload loop ===
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sync health_reports/*.md chunks to Supabase")
+    parser.add_argument("--full", action="store_true", help="Re-embed and upsert every chunk")
+    parser.add_argument("--manifest", default=MANIFEST_PATH)
+    args = parser.parse_args()
+
     # Verify connection to Supabase
     try:
         test_response = requests.get(
             f"{SUPABASE_URL}/rest/v1/",
-            headers=headers
+            headers=headers,
+            timeout=SUPABASE_TIMEOUT,
         )
         print(f"Supabase connection test: {test_response.status_code}")
         if test_response.status_code != 200:
@@ -271,6 +492,11 @@ if __name__ == "__main__":
         ("campisi", "campisi_chunks")
     ]
 
+    session = make_session(INGEST_CONCURRENCY)
+    manifest = Manifest(args.manifest)
+    total_rows = 0
+    total_start = time.perf_counter()
+
     for doctor, table in doctors:
         md_file = f"health_reports/{doctor}.md"
         if not os.path.exists(md_file):
@@ -278,10 +504,15 @@ if __name__ == "__main__":
             continue
             
         print(f"\n📚 Uploading: {doctor} → {table}")
-        upload_chunks(
+        total_rows += upload_chunks(
             md_file=md_file,
             doctor=doctor,
-            supabase_table=table
+            supabase_table=table,
+            session=session,
+            manifest=manifest,
+            full=args.full
         )
 
-    print("\n✅ All uploads completed.")
+    total_elapsed = time.perf_counter() - total_start
+    print(f"\n✅ All uploads completed: {total_rows} rows in {total_elapsed:.1f}s "
+          f"({total_rows / total_elapsed if total_elapsed else 0:.1f} rows/sec)")
@@ -1,69 +1,265 @@
 import fitz  # PyMuPDF
 import os
+import re
 import json
-import time
+import argparse
+import itertools
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from pathlib import Path
 from dotenv import load_dotenv
 from tqdm import tqdm
 import cohere
+from yomo_backend.resilience import call_sync, timeouts
 
-# === Step 1: Load API key ===
-load_dotenv()
-cohere_api_key = os.getenv("COHERE_API_KEY")
-if not cohere_api_key:
-    raise ValueError("Missing COHERE_API_KEY in .env file")
+EMBED_MODEL = "embed-english-v3.0"
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "96"))  # Cohere's per-call maximum
+EMBED_CONCURRENCY = int(os.getenv("EMBED_CONCURRENCY", "4"))
+MAX_TOKENS = int(os.getenv("CHUNK_MAX_TOKENS", "750"))
+OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "0"))
 
-co = cohere.Client(cohere_api_key)
+SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
 
-# === Step 2: Load PDF ===
-pdf_path = Path("/Users/alexanderlange/Downloads/Sinclair’s Research.pdf")
-doc = fitz.open(pdf_path)
+# === Tokenizer: built once per process ===
+@lru_cache(maxsize=None)
+def get_encoder():
+    import tiktoken
+    return tiktoken.get_encoding("cl100k_base")
 
 # === Step 3: Chunking helper ===
-def chunk_text(text, max_tokens=750):
-    import tiktoken
-    enc = tiktoken.get_encoding("cl100k_base")
-    words = text.split()
-    chunks, current = [], []
-    for word in words:
-        current.append(word)
-        if len(enc.encode(" ".join(current))) > max_tokens:
-            chunks.append(" ".join(current))
-            current = []
+# Each page is tokenized once (all its sentences in one encode_batch call).
+# Sentences are packed greedily into chunks of at most `max_tokens`; the
+# last sentences of a chunk (up to `overlap` tokens) are repeated at the
+# start of the next. A sentence longer than `max_tokens` is cut into
+# overlapping token windows. Linear in the length of the page. Yields
+# (chunk, token_count) pairs; the count of a packed chunk allows one token per
+# joining space, so it is an upper bound, safe for context budgets.
+def chunk_text(text, max_tokens=MAX_TOKENS, overlap=0):
+    if overlap >= max_tokens:
+        raise ValueError("overlap must be smaller than max_tokens")
+    enc = get_encoder()
+
+    sentences = [s.strip() for s in SENTENCE_END.split(text) if s.strip()]
+    if not sentences:
+        return
+
+    current, current_tokens = [], 0
+    for sentence, tokens in zip(sentences, enc.encode_batch(sentences)):
+        count = len(tokens)
+
+        if count > max_tokens:
+            if current:
+                yield " ".join(s for s, _ in current), current_tokens
+                current, current_tokens = [], 0
+            step = max_tokens - overlap
+            for start in range(0, count, step):
+                window = tokens[start:start + max_tokens]
+                yield enc.decode(window), len(window)
+                if start + max_tokens >= count:
+                    break
+            continue
+
+        # +1 approximates the joining space between sentences
+        if current and current_tokens + count + 1 > max_tokens:
+            yield " ".join(s for s, _ in current), current_tokens
+            carried, carried_tokens = [], 0
+            for s, c in reversed(current):
+                if carried_tokens + c > overlap:
+                    break
+                carried.insert(0, (s, c))
+                carried_tokens += c
+            if carried_tokens + count + 1 > max_tokens:
+                carried, carried_tokens = [], 0
+            current, current_tokens = carried, carried_tokens
+
+        current.append((sentence, count))
+        current_tokens += count + (1 if len(current) > 1 else 0)
+
     if current:
-        chunks.append(" ".join(current))
-    return chunks
-
-# === Step 4: Extract chunks from PDF ===
-all_chunks = []
-for page in doc:
-    text = page.get_text()
-    chunks = chunk_text(text)
-    for chunk in chunks:
-        all_chunks.append({
-            "text": chunk.strip(),
-            "page": page.number + 1
-        })
-
-print(f"Extracted {len(all_chunks)} chunks")
-
-# === Step 5: Generate embeddings via Cohere ===
-texts = [c['text'] for c in all_chunks]
-
-print("⏳ Generating embeddings with Cohere...")
-response = co.embed(
-    texts=texts,
-    model="embed-english-v3.0",
-    input_type="search_document"
-)
-embeddings = response.embeddings
-
-# Attach embeddings to chunks
-for i in range(len(all_chunks)):
-    all_chunks[i]['embedding'] = embeddings[i]
-
-# === Step 6: Save to JSON ===
-with open("sinclair_chunks.json", "w") as f:
-    json.dump(all_chunks, f)
-
-print("Saved embedded chunks to sinclair_chunks.json")
+        yield " ".join(s for s, _ in current), current_tokens
+
+# === Step 4: Stream chunks from the PDF, page by page ===
+def iter_pdf_chunks(doc, max_tokens=MAX_TOKENS, overlap=OVERLAP_TOKENS):
+    for page in doc:
+        for chunk, token_count in chunk_text(page.get_text(), max_tokens, overlap):
+            chunk = chunk.strip()
+            if chunk:
+                yield {"text": chunk, "page": page.number + 1, "token_count": token_count}
+
+
+# === Step 5: Embed one bounded batch ===
+# Timeouts, dropped connections, 429 and 5xx are retried with backoff (see
+# yomo_backend/resilience.py); anything else fails the run, which resumes
+# from the checkpoint.
+def embed_batch(co, texts):
+    response = call_sync("cohere", lambda: co.embed(
+        texts=texts,
+        model=EMBED_MODEL,
+        input_type="search_document"
+    ))
+    return response.embeddings
+
+
+def iter_batches(items, size):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+# === Step 6: Checkpoint of what has been durably written to the output ===
+# `offset` is the output size after the last committed batch; anything past
+# it was written by a run that crashed before checkpointing and is truncated
+# on resume. Per source we keep how many chunks are done, so a resumed run
+# re-chunks the PDF (cheap) and skips straight to the first missing batch.
+class Checkpoint:
+    def __init__(self, path):
+        self.path = path
+        self.offset = 0
+        self.sources = {}
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            self.offset = data["offset"]
+            self.sources = data["sources"]
+
+    def save(self):
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"offset": self.offset, "sources": self.sources}, f, indent=1)
+        os.replace(tmp, self.path)
+
+
+def source_fingerprint(pdf_path, max_tokens, overlap):
+    stat = pdf_path.stat()
+    return f"{stat.st_size}:{stat.st_mtime_ns}:{max_tokens}:{overlap}"
+
+
+def find_pdfs(paths):
+    for path in map(Path, paths):
+        if path.is_dir():
+            yield from sorted(path.rglob("*.pdf"))
+        else:
+            yield path
+
+
+# Batches are embedded concurrently but committed in order: each committed
+# batch is appended to the JSON Lines output, fsynced, then checkpointed.
+def embed_pdf(co, pool, pdf_path, out, checkpoint, batch_size, concurrency, max_tokens, overlap):
+    key = str(pdf_path.resolve())
+    fingerprint = source_fingerprint(pdf_path, max_tokens, overlap)
+    state = checkpoint.sources.get(key)
+    if state and state["fingerprint"] != fingerprint:
+        raise SystemExit(f"{pdf_path} or the chunk settings changed since it was checkpointed; rerun with --restart")
+    if state and state["complete"]:
+        print(f"⏭️  {pdf_path.name}: already embedded ({state['done']} chunks)")
+        return 0
+    state = state or {"fingerprint": fingerprint, "done": 0, "complete": False}
+
+    doc = fitz.open(pdf_path)
+    chunks = itertools.islice(iter_pdf_chunks(doc, max_tokens, overlap), state["done"], None)
+    progress = tqdm(desc=pdf_path.name, unit=" chunks", initial=state["done"])
+    pending = deque()
+    written = 0
+
+    def commit(batch, future):
+        nonlocal written
+        embeddings = future.result()
+        lines = [
+            json.dumps({**chunk, "source": pdf_path.name, "embedding": embedding})
+            for chunk, embedding in zip(batch, embeddings)
+        ]
+        out.write(("\n".join(lines) + "\n").encode("utf-8"))
+        out.flush()
+        os.fsync(out.fileno())
+        state["done"] += len(batch)
+        checkpoint.offset = out.tell()
+        checkpoint.sources[key] = state
+        checkpoint.save()
+        written += len(batch)
+        progress.update(len(batch))
+
+    try:
+        for batch in iter_batches(chunks, batch_size):
+            future = pool.submit(embed_batch, co, [c["text"] for c in batch])
+            pending.append((batch, future))
+            if len(pending) >= concurrency:
+                commit(*pending.popleft())
+        while pending:
+            commit(*pending.popleft())
+    finally:
+        for _, future in pending:
+            future.cancel()
+        progress.close()
+        doc.close()
+
+    state["complete"] = True
+    checkpoint.sources[key] = state
+    checkpoint.save()
+    return written
+
+
+def export_json(jsonl_path, json_path):
+    with open(jsonl_path, "r", encoding="utf-8") as f:
+        rows = [json.loads(line) for line in f if line.strip()]
+    with open(json_path, "w") as f:
+        json.dump(rows, f)
+    return len(rows)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Chunk and embed PDFs with Cohere, resumably")
+    parser.add_argument("pdfs", nargs="+", help="PDF files or directories of PDFs")
+    parser.add_argument("--out", default="chunks.jsonl", help="Append-only JSON Lines output")
+    parser.add_argument("--checkpoint", help="Checkpoint file (default: <out>.checkpoint.json)")
+    parser.add_argument("--batch-size", type=int, default=EMBED_BATCH_SIZE)
+    parser.add_argument("--concurrency", type=int, default=EMBED_CONCURRENCY)
+    parser.add_argument("--max-tokens", type=int, default=MAX_TOKENS)
+    parser.add_argument("--overlap", type=int, default=OVERLAP_TOKENS)
+    parser.add_argument("--restart", action="store_true", help="Discard the output and checkpoint and start over")
+    parser.add_argument("--export-json", help="Also write the finished output as one JSON array (sinclair_chunks.json format)")
+    args = parser.parse_args()
+
+    if not 1 <= args.batch_size <= 96:
+        parser.error("--batch-size must be between 1 and 96 (Cohere's per-call maximum)")
+
+    # === Step 1: Load API key ===
+    load_dotenv()
+    cohere_api_key = os.getenv("COHERE_API_KEY")
+    if not cohere_api_key:
+        raise ValueError("Missing COHERE_API_KEY in .env file")
+
+    # Retries are ours (embed_batch)
+    co = cohere.Client(cohere_api_key, timeout=timeouts("cohere")[1], max_retries=0)
+
+    # === Step 2: Resume from the checkpoint, if any ===
+    checkpoint_path = args.checkpoint or f"{args.out}.checkpoint.json"
+    if args.restart:
+        for path in (args.out, checkpoint_path):
+            if os.path.exists(path):
+                os.remove(path)
+    elif os.path.exists(args.out) and not os.path.exists(checkpoint_path):
+        raise SystemExit(f"{args.out} exists without a checkpoint; pass --restart to overwrite it")
+
+    checkpoint = Checkpoint(checkpoint_path)
+    if os.path.exists(args.out) and os.path.getsize(args.out) > checkpoint.offset:
+        os.truncate(args.out, checkpoint.offset)  # drop the tail of an interrupted batch
+
+    total = 0
+    with open(args.out, "ab") as out, ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        for pdf_path in find_pdfs(args.pdfs):
+            total += embed_pdf(
+                co, pool, pdf_path, out, checkpoint,
+                args.batch_size, args.concurrency, args.max_tokens, args.overlap,
+            )
+
+    print(f"Embedded {total} new chunks into {args.out}")
+
+    if args.export_json:
+        count = export_json(args.out, args.export_json)
+        print(f"Saved {count} embedded chunks to {args.export_json}")
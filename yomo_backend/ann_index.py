@@ -0,0 +1,248 @@
+import argparse
+import asyncio
+import os
+import numpy as np
+
+from chunk_store import ChunkStore, iter_json_rows, parse_embedding, write_chunk_store
+from resilience import call_async, check_status
+
+# === In-process IVF-flat index over normalized float32 embeddings ===
+# Vectors are clustered with spherical k-means into `nlist` inverted lists.
+# A query scores the centroids, then does an exact dot product against the
+# vectors of the `nprobe` closest lists. nprobe is the recall knob:
+# nprobe >= nlist is an exact search, smaller values trade recall for speed.
+# Saved as a float32 chunk store (chunk_store.py) plus the clustering, so a
+# loaded index maps its vectors and texts instead of reading them into memory.
+
+RECORD_FIELDS = ("id", "title", "text", "page", "token_count")
+
+
+def normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def spherical_kmeans(vectors, k, iterations=10, sample_size=None, seed=0):
+    rng = np.random.default_rng(seed)
+    train = vectors
+    if sample_size and len(vectors) > sample_size:
+        train = vectors[rng.choice(len(vectors), sample_size, replace=False)]
+
+    centroids = train[rng.choice(len(train), k, replace=False)].copy()
+    for _ in range(iterations):
+        assign = np.argmax(train @ centroids.T, axis=1)
+        for c in range(k):
+            members = train[assign == c]
+            if len(members):
+                centroids[c] = members.sum(axis=0)
+            else:
+                # Re-seed empty lists from a random training vector
+                centroids[c] = train[rng.integers(len(train))]
+        centroids = normalize(centroids)
+    return centroids
+
+
+class IVFFlatIndex:
+    def __init__(self, nlist=None, nprobe=8, seed=0):
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.seed = seed
+        self.centroids = None
+        self.vectors = None
+        self.offsets = None
+        self.records = []
+        self.store = None  # ChunkStore after load(); holds the records instead
+
+    def __len__(self):
+        return len(self.store) if self.store is not None else len(self.records)
+
+    def record(self, row):
+        return self.store.record(row) if self.store is not None else self.records[row]
+
+    def iter_records(self):
+        for row in range(len(self)):
+            yield self.record(row)
+
+    def build(self, embeddings, records):
+        vectors = normalize(embeddings)
+        if len(vectors) != len(records):
+            raise ValueError(f"{len(vectors)} embeddings for {len(records)} records")
+        if not len(vectors):
+            raise ValueError("Cannot build an index without vectors")
+
+        nlist = self.nlist or max(1, int(np.sqrt(len(vectors))))
+        nlist = min(nlist, len(vectors))
+        centroids = spherical_kmeans(
+            vectors, nlist, sample_size=256 * nlist, seed=self.seed
+        )
+
+        # Store vectors grouped by list so each probe is one contiguous slice
+        assign = np.argmax(vectors @ centroids.T, axis=1)
+        order = np.argsort(assign, kind="stable")
+        counts = np.bincount(assign, minlength=nlist)
+
+        self.nlist = nlist
+        self.centroids = centroids
+        self.vectors = np.ascontiguousarray(vectors[order])
+        self.offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+        self.records = [
+            {f: records[i][f] for f in RECORD_FIELDS if f in records[i]} for i in order
+        ]
+        return self
+
+    def search(self, query_embedding, top_k=5, nprobe=None, with_vectors=False):
+        query = normalize(query_embedding)
+        nprobe = min(nprobe or self.nprobe, self.nlist)
+
+        if nprobe >= self.nlist:
+            candidates = np.arange(len(self.vectors))
+            scores = self.vectors @ query
+        else:
+            probes = np.argpartition(-(self.centroids @ query), nprobe - 1)[:nprobe]
+            candidates = np.concatenate(
+                [np.arange(self.offsets[p], self.offsets[p + 1]) for p in probes]
+            )
+            scores = self.vectors[candidates] @ query
+
+        k = min(top_k, len(candidates))
+        if k <= 0:
+            return []
+        best = np.argpartition(-scores, k - 1)[:k]
+        best = best[np.argsort(-scores[best])]
+
+        return [
+            self.hit(candidates[i], scores[i], with_vectors)
+            for i in best
+        ]
+
+    def hit(self, row, score, with_vectors=False):
+        hit = {**self.record(row), "similarity": float(score)}
+        if with_vectors:
+            hit["embedding"] = self.vectors[row]
+        return hit
+
+    def search_batch(self, query_embeddings, top_k=5, nprobe=None, with_vectors=False):
+        queries = normalize(query_embeddings)
+        nprobe = min(nprobe or self.nprobe, self.nlist)
+
+        if nprobe < self.nlist:
+            return [self.search(q, top_k, nprobe, with_vectors) for q in queries]
+
+        # Exact mode: score every query against every vector in one matmul
+        scores = queries @ self.vectors.T
+        k = min(top_k, scores.shape[1])
+        if k <= 0:
+            return [[] for _ in queries]
+        best = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        best_scores = np.take_along_axis(scores, best, axis=1)
+        order = np.argsort(-best_scores, axis=1)
+        best = np.take_along_axis(best, order, axis=1)
+
+        return [
+            [self.hit(i, row_scores[i], with_vectors) for i in row]
+            for row, row_scores in zip(best, scores)
+        ]
+
+    # Rows are stored in list order, so offsets index the store directly
+    def save(self, path):
+        write_chunk_store(path, (
+            {**record, "embedding": vector} for record, vector in zip(self.iter_records(), self.vectors)
+        ))
+        np.savez(
+            os.path.join(path, "ivf.npz"),
+            centroids=self.centroids,
+            offsets=self.offsets,
+            nprobe=self.nprobe,
+        )
+
+    @classmethod
+    def load(cls, path, nprobe=None):
+        with np.load(os.path.join(path, "ivf.npz")) as arrays:
+            index = cls(nprobe=nprobe or int(arrays["nprobe"]))
+            index.centroids = arrays["centroids"]
+            index.offsets = arrays["offsets"]
+        index.store = ChunkStore(path)
+        index.vectors = index.store.vectors
+        index.nlist = len(index.centroids)
+        return index
+
+    @staticmethod
+    def exists(path):
+        return ChunkStore.exists(path) and os.path.exists(os.path.join(path, "ivf.npz"))
+
+
+# === Loading chunks ===
+# Each page is one upstream call with its own retries, so a transient error
+# on page 40 does not restart the whole fetch
+async def fetch_supabase_rows(client, table, page_size=1000, columns="id,title,text,embedding", on_retry=None):
+    rows = []
+    while True:
+        async def fetch_page():
+            return check_status("supabase", await client.get(
+                f"/rest/v1/{table}",
+                params={
+                    "select": columns,
+                    "order": "id",
+                    "limit": str(page_size),
+                    "offset": str(len(rows)),
+                },
+            ))
+
+        res = await call_async("supabase", fetch_page, on_retry=on_retry)
+        if res.status_code != 200:
+            raise Exception(f"Supabase fetch error: {res.text}")
+        page = res.json()
+        rows.extend(page)
+        if len(page) < page_size:
+            return rows
+
+
+def build_from_rows(rows, nlist=None, nprobe=8):
+    embeddings = [parse_embedding(r["embedding"]) for r in rows]
+    return IVFFlatIndex(nlist=nlist, nprobe=nprobe).build(embeddings, rows)
+
+
+# === CLI: python ann_index.py sinclair --out indexes/sinclair ===
+if __name__ == "__main__":
+    import httpx
+    from dotenv import load_dotenv
+    from resilience import timeouts
+
+    parser = argparse.ArgumentParser(description="Build a local IVF-flat index for one doctor")
+    parser.add_argument("doctor")
+    parser.add_argument("--out", help="Index directory (default: indexes/<doctor>)")
+    parser.add_argument("--json", help="Build from a chunks JSON / JSON Lines file instead of Supabase")
+    parser.add_argument("--store", help="Build from a chunk store directory (chunk_store.py)")
+    parser.add_argument("--nlist", type=int)
+    parser.add_argument("--nprobe", type=int, default=8)
+    args = parser.parse_args()
+
+    if args.store:
+        with ChunkStore(args.store) as store:
+            index = IVFFlatIndex(nlist=args.nlist, nprobe=args.nprobe).build(
+                store.vectors, list(store.iter_records())
+            )
+    elif args.json:
+        rows = list(iter_json_rows(args.json))
+    else:
+        load_dotenv()
+        key = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
+        connect, read = timeouts("supabase")
+
+        async def fetch():
+            async with httpx.AsyncClient(
+                base_url=os.getenv("SUPABASE_URL"),
+                headers={"apikey": key, "Authorization": f"Bearer {key}"},
+                timeout=httpx.Timeout(read, connect=connect),
+            ) as client:
+                return await fetch_supabase_rows(client, f"{args.doctor}_chunks")
+
+        rows = asyncio.run(fetch())
+
+    if not args.store:
+        index = build_from_rows(rows, nlist=args.nlist, nprobe=args.nprobe)
+    out = args.out or os.path.join("indexes", args.doctor)
+    index.save(out)
+    print(f"Indexed {len(index)} chunks in {index.nlist} lists → {out}/")
@@ -0,0 +1,98 @@
+import math
+import re
+from collections import Counter
+import numpy as np
+
+from ann_index import RECORD_FIELDS
+
+# === In-process BM25 inverted index ===
+# Built from the same chunk records as the vector indexes (title + text).
+# Each posting list stores the precomputed BM25 weight of the term in each
+# document, so a query is one scatter-add per query term plus a top-k.
+# Exact terms like "NMN", "rapamycin" or "senolytics" that embeddings blur
+# are matched literally, and no embedding call is needed.
+
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+STOPWORDS = frozenset(
+    "a an and are as at be but by do does for from has have how i if in is it its of on or "
+    "should so than that the their there these this to was what when which who why will with "
+    "you your about can my me we our".split()
+)
+
+
+def tokenize(text):
+    return [t for t in TOKEN_RE.findall(text.lower()) if t not in STOPWORDS]
+
+
+class BM25Index:
+    def __init__(self, k1=1.2, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.records = []
+        self.postings = {}  # term -> (doc ids, weights)
+
+    def __len__(self):
+        return len(self.records)
+
+    def build(self, records):
+        self.records = [{f: r[f] for f in RECORD_FIELDS if f in r} for r in records]
+        n = len(self.records)
+
+        term_docs = {}
+        lengths = np.zeros(n, dtype=np.float32)
+        for i, record in enumerate(self.records):
+            terms = tokenize(f"{record.get('title', '')} {record.get('text', '')}")
+            lengths[i] = len(terms)
+            for term, tf in Counter(terms).items():
+                docs, tfs = term_docs.setdefault(term, ([], []))
+                docs.append(i)
+                tfs.append(tf)
+
+        avg_length = float(lengths.mean()) if n else 0.0
+        norm = self.k1 * (1 - self.b + self.b * lengths / (avg_length or 1.0))
+
+        self.postings = {}
+        for term, (docs, tfs) in term_docs.items():
+            docs = np.asarray(docs, dtype=np.int32)
+            tfs = np.asarray(tfs, dtype=np.float32)
+            idf = math.log(1 + (n - len(docs) + 0.5) / (len(docs) + 0.5))
+            self.postings[term] = (docs, idf * tfs * (self.k1 + 1) / (tfs + norm[docs]))
+        return self
+
+    def search(self, query, top_k=5):
+        scores = np.zeros(len(self.records), dtype=np.float32)
+        for term in set(tokenize(query)):
+            posting = self.postings.get(term)
+            if posting is not None:
+                scores[posting[0]] += posting[1]  # doc ids are unique per term
+
+        matched = np.flatnonzero(scores)
+        k = min(top_k, len(matched))
+        if k <= 0:
+            return []
+        best = matched[np.argpartition(-scores[matched], k - 1)[:k]]
+        best = best[np.argsort(-scores[best])]
+        return [{**self.records[i], "bm25": float(scores[i])} for i in best]
+
+
+# === Reciprocal rank fusion ===
+# score(d) = sum over rankings of 1 / (k + rank of d). Only ranks matter, so
+# BM25 scores and cosine similarities never need to be put on one scale.
+def chunk_key(chunk):
+    return chunk.get("id") or chunk.get("text")
+
+
+def reciprocal_rank_fusion(rankings, top_k=5, k=60):
+    fused = {}
+    for ranking in rankings:
+        for rank, chunk in enumerate(ranking, start=1):
+            key = chunk_key(chunk)
+            entry = fused.get(key)
+            if entry is None:
+                fused[key] = entry = [0.0, dict(chunk)]
+            else:
+                entry[1].update(chunk)  # keep both the similarity and the bm25 score
+            entry[0] += 1.0 / (k + rank)
+
+    ranked = sorted(fused.values(), key=lambda e: e[0], reverse=True)[:top_k]
+    return [{**chunk, "rrf": score} for score, chunk in ranked]
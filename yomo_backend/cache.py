@@ -0,0 +1,241 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+
+# === Bounded answer cache ===
+# LRU over entry count and approximate serialized size, with a per-entry TTL.
+# Entries past their TTL stay servable as "stale" for `stale_ttl` more
+# seconds so callers can answer immediately and refresh in the background.
+
+FRESH = "fresh"
+STALE = "stale"
+
+
+def entry_size(value):
+    return len(json.dumps(value, default=str).encode())
+
+
+class AnswerCache:
+    def __init__(self, max_entries=2048, max_bytes=None, ttl=86400, stale_ttl=3600):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self._entries = OrderedDict()  # key -> (value, size, stored_at, ttl)
+        self._bytes = 0
+        self._refreshing = set()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return self.get(key, count=False)[0] is not None
+
+    def get(self, key, count=True):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                if count:
+                    self.misses += 1
+                return None, None
+
+            value, _, stored_at, ttl = entry
+            age = time.monotonic() - stored_at
+            if ttl is not None and age > ttl + self.stale_ttl:
+                self._remove(key)
+                self.expirations += 1
+                if count:
+                    self.misses += 1
+                return None, None
+
+            self._entries.move_to_end(key)
+            if ttl is not None and age > ttl:
+                if count:
+                    self.stale_hits += 1
+                return value, STALE
+            if count:
+                self.hits += 1
+            return value, FRESH
+
+    def set(self, key, value, ttl=None):
+        size = entry_size(value)
+        if self.max_bytes is not None and size > self.max_bytes:
+            return
+        with self._lock:
+            self._store(key, value, size, ttl)
+
+    # Atomically: return the live entry if there is one, otherwise store
+    # `value`. Returns (value, stored) where stored says which happened.
+    def get_or_set(self, key, value, ttl=None):
+        size = entry_size(value)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                cached, _, stored_at, entry_ttl = entry
+                if entry_ttl is None or time.monotonic() - stored_at <= entry_ttl + self.stale_ttl:
+                    self._entries.move_to_end(key)
+                    return cached, False
+            if self.max_bytes is None or size <= self.max_bytes:
+                self._store(key, value, size, ttl)
+        return value, True
+
+    def delete(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._refreshing.clear()
+            self._bytes = 0
+
+    # Returns True for exactly one caller per stale key until it is set again
+    def begin_refresh(self, key):
+        with self._lock:
+            if key in self._refreshing:
+                return False
+            self._refreshing.add(key)
+            return True
+
+    def end_refresh(self, key):
+        with self._lock:
+            self._refreshing.discard(key)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.stale_hits + self.misses
+            return {
+                "backend": "memory",
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "stale_hits": self.stale_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "hit_ratio": (self.hits + self.stale_hits) / lookups if lookups else 0.0,
+            }
+
+    # Caller holds the lock
+    def _store(self, key, value, size, ttl):
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (value, size, time.monotonic(), ttl or self.ttl)
+        self._bytes += size
+        self._refreshing.discard(key)
+        self._evict()
+
+    def _remove(self, key):
+        _, size, _, _ = self._entries.pop(key)
+        self._bytes -= size
+
+    def _evict(self):
+        while self._entries and (
+            (self.max_entries is not None and len(self._entries) > self.max_entries)
+            or (self.max_bytes is not None and self._bytes > self.max_bytes)
+        ):
+            key = next(iter(self._entries))
+            self._remove(key)
+            self.evictions += 1
+
+
+# === Semantic answer cache ===
+# Per doctor, a fixed-capacity matrix of normalized query embeddings. A lookup
+# is one matrix-vector product; the best match above `threshold` cosine
+# similarity is a hit. When full, the least recently used row is replaced.
+
+class SemanticCache:
+    def __init__(self, threshold=0.92, capacity=512, ttl=86400, dim=1024):
+        self.threshold = threshold
+        self.capacity = capacity
+        self.ttl = ttl
+        self.dim = dim
+        self._doctors = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _slots(self, doctor):
+        slots = self._doctors.get(doctor)
+        if slots is None:
+            slots = {
+                "vectors": np.zeros((self.capacity, self.dim), dtype=np.float32),
+                "stored_at": np.full(self.capacity, -np.inf),
+                "last_used": np.full(self.capacity, -np.inf),
+                "values": [None] * self.capacity,
+                "size": 0,
+            }
+            self._doctors[doctor] = slots
+        return slots
+
+    def get(self, doctor, query_embedding):
+        query = _unit(query_embedding)
+        now = time.monotonic()
+        with self._lock:
+            slots = self._doctors.get(doctor)
+            if slots is None or slots["size"] == 0:
+                self.misses += 1
+                return None
+
+            n = slots["size"]
+            scores = slots["vectors"][:n] @ query
+            scores[now - slots["stored_at"][:n] > self.ttl] = -np.inf
+            best = int(np.argmax(scores))
+            if scores[best] < self.threshold:
+                self.misses += 1
+                return None
+
+            slots["last_used"][best] = now
+            self.hits += 1
+            return slots["values"][best]
+
+    def set(self, doctor, query_embedding, value):
+        query = _unit(query_embedding)
+        now = time.monotonic()
+        with self._lock:
+            slots = self._slots(doctor)
+            if slots["size"] < self.capacity:
+                slot = slots["size"]
+                slots["size"] += 1
+            else:
+                slot = int(np.argmin(slots["last_used"]))
+                self.evictions += 1
+            slots["vectors"][slot] = query
+            slots["stored_at"][slot] = now
+            slots["last_used"][slot] = now
+            slots["values"][slot] = value
+
+    def clear(self):
+        with self._lock:
+            self._doctors.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": {d: s["size"] for d, s in self._doctors.items()},
+                "capacity": self.capacity,
+                "threshold": self.threshold,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+            }
+
+
+def _unit(vector):
+    vector = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
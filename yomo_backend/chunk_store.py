@@ -0,0 +1,184 @@
+import argparse
+import json
+import mmap
+import os
+import numpy as np
+
+# === Binary, memory-mapped chunk store ===
+# A store is a directory:
+#   vectors.f32 | vectors.f16   row-major (count, dim) matrix, no header
+#   texts.bin                   UTF-8 chunk texts, back to back
+#   meta.json                   dtype, dim, count and one record per row
+#                               (id/title/page/source/token_count +
+#                               text offset/length)
+#
+# Readers map vectors and texts read-only, so opening a store costs one small
+# JSON parse, and every worker process shares the same page-cache copy.
+
+DTYPES = {"float32": "f32", "float16": "f16"}
+META_FIELDS = ("id", "title", "page", "source", "token_count")
+
+
+def vectors_file(dtype):
+    return f"vectors.{DTYPES[dtype]}"
+
+
+def parse_embedding(value):
+    # pgvector columns come back from PostgREST as "[0.1,0.2,...]" strings
+    return json.loads(value) if isinstance(value, str) else value
+
+
+# === Writer: streams rows straight to disk ===
+class ChunkStoreWriter:
+    def __init__(self, path, dtype="float32"):
+        if dtype not in DTYPES:
+            raise ValueError(f"dtype must be one of {sorted(DTYPES)}")
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.dtype = dtype
+        self.dim = None
+        self.records = []
+        self.text_offset = 0
+        self._vectors = open(os.path.join(path, f"{vectors_file(dtype)}.tmp"), "wb")
+        self._texts = open(os.path.join(path, "texts.bin.tmp"), "wb")
+
+    def add(self, row):
+        vector = np.asarray(parse_embedding(row["embedding"]), dtype=self.dtype)
+        if self.dim is None:
+            self.dim = len(vector)
+        elif len(vector) != self.dim:
+            raise ValueError(f"embedding has {len(vector)} dims, store has {self.dim}")
+
+        text = row["text"].encode("utf-8")
+        self._vectors.write(vector.tobytes())
+        self._texts.write(text)
+
+        record = {f: row[f] for f in META_FIELDS if f in row}
+        record["offset"] = self.text_offset
+        record["length"] = len(text)
+        self.records.append(record)
+        self.text_offset += len(text)
+
+    def close(self):
+        # Data files first, meta.json last: a reader never sees a count that
+        # points past the end of the files it maps.
+        for f in (self._vectors, self._texts):
+            f.flush()
+            os.fsync(f.fileno())
+            f.close()
+        for name in (vectors_file(self.dtype), "texts.bin"):
+            os.replace(os.path.join(self.path, f"{name}.tmp"), os.path.join(self.path, name))
+
+        meta = {
+            "dtype": self.dtype,
+            "dim": self.dim or 0,
+            "count": len(self.records),
+            "records": self.records,
+        }
+        tmp = os.path.join(self.path, "meta.json.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        os.replace(tmp, os.path.join(self.path, "meta.json"))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self.close()
+        else:
+            self._vectors.close()
+            self._texts.close()
+
+
+def write_chunk_store(path, rows, dtype="float32"):
+    with ChunkStoreWriter(path, dtype) as writer:
+        for row in rows:
+            writer.add(row)
+    return len(writer.records)
+
+
+# === Reader ===
+class ChunkStore:
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, "meta.json"), encoding="utf-8") as f:
+            meta = json.load(f)
+        self.dtype = meta["dtype"]
+        self.dim = meta["dim"]
+        self.records = meta["records"]
+
+        count = meta["count"]
+        if count and self.dim:
+            self.vectors = np.memmap(
+                os.path.join(path, vectors_file(self.dtype)),
+                dtype=self.dtype, mode="r", shape=(count, self.dim),
+            )
+        else:
+            self.vectors = np.zeros((0, self.dim), dtype=self.dtype)
+
+        self._texts_file = open(os.path.join(path, "texts.bin"), "rb")
+        size = os.fstat(self._texts_file.fileno()).st_size
+        self._texts = mmap.mmap(self._texts_file.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+
+    def __len__(self):
+        return len(self.records)
+
+    def text(self, i):
+        record = self.records[i]
+        return self._texts[record["offset"]:record["offset"] + record["length"]].decode("utf-8")
+
+    def record(self, i):
+        record = {k: v for k, v in self.records[i].items() if k not in ("offset", "length")}
+        record["text"] = self.text(i)
+        return record
+
+    def iter_records(self):
+        for i in range(len(self)):
+            yield self.record(i)
+
+    def close(self):
+        if isinstance(self._texts, mmap.mmap):
+            self._texts.close()
+        self._texts_file.close()
+        self.vectors = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @staticmethod
+    def exists(path):
+        return os.path.exists(os.path.join(path, "meta.json"))
+
+
+# === Converter from chunks JSON (yomo.py --export-json) or JSON Lines (yomo.py --out) ===
+def iter_json_rows(path):
+    with open(path, encoding="utf-8") as f:
+        if str(path).endswith(".jsonl"):
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            yield from json.load(f)
+
+
+def convert_json(json_path, out_path, dtype="float32"):
+    return write_chunk_store(out_path, iter_json_rows(json_path), dtype)
+
+
+# === CLI: python chunk_store.py ../Sinclair/sinclair_chunks.json --out ../Sinclair/sinclair_store ===
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert a chunks JSON / JSON Lines file to a binary chunk store")
+    parser.add_argument("json")
+    parser.add_argument("--out", help="Store directory (default: <json> without extension + _store)")
+    parser.add_argument("--dtype", choices=sorted(DTYPES), default="float32")
+    args = parser.parse_args()
+
+    out = args.out or os.path.splitext(args.json)[0] + "_store"
+    count = convert_json(args.json, out, args.dtype)
+    size = sum(os.path.getsize(os.path.join(out, name)) for name in os.listdir(out))
+    print(f"Stored {count} chunks ({args.dtype}) in {out}: {size / 1024:.0f} KB "
+          f"vs {os.path.getsize(args.json) / 1024:.0f} KB of JSON")
@@ -0,0 +1,79 @@
+import re
+import numpy as np
+
+from bm25 import tokenize
+from mmr import text_vectors
+from tokens import count_tokens, count_tokens_batch
+
+# === Token-budgeted context assembly ===
+# Retrieved chunks go into the prompt whole while they fit the budget. Over
+# budget, every chunk is split into sentences, all sentences are scored
+# against the question in one matmul (hashed term vectors, stopwords
+# dropped), and the best ones are kept until the budget is spent. Kept
+# sentences are put back in document order under their original chunk, so
+# the title / doctor / id attribution of every passage survives; gaps are
+# marked with "…". Chunks that lose every sentence are dropped, but the best
+# sentence of the top-ranked chunk is kept even when it alone is over budget,
+# so the prompt never ends up without context.
+
+SENTENCE_RE = re.compile(r"(?<=[.!?])\s+|\n+")
+CHUNK_OVERHEAD_TOKENS = 8  # separator and "[Dr. X]" label per passage
+RANK_PRIOR = 0.05  # earlier (better retrieved) chunks win ties
+
+
+def split_sentences(text):
+    return [s.strip() for s in SENTENCE_RE.split(text) if s and s.strip()]
+
+
+def chunk_tokens(chunk):
+    count = chunk.get("token_count")
+    return count if count is not None else count_tokens(chunk["text"])
+
+
+def fit_to_budget(question, chunks, budget):
+    if sum(chunk_tokens(c) + CHUNK_OVERHEAD_TOKENS for c in chunks) <= budget:
+        return chunks
+
+    owners, sentences = [], []
+    for i, chunk in enumerate(chunks):
+        for sentence in split_sentences(chunk["text"]):
+            owners.append(i)
+            sentences.append(sentence)
+    if not sentences:
+        return []
+    owners = np.asarray(owners)
+
+    vectors = text_vectors(sentences + [question], tokenize=tokenize)
+    scores = vectors[:-1] @ vectors[-1] + RANK_PRIOR * (1 - owners / len(chunks))
+    costs = np.asarray(count_tokens_batch(sentences))
+
+    keep = np.zeros(len(sentences), dtype=bool)
+    opened = np.zeros(len(chunks), dtype=bool)
+    used = 0
+    for j in np.argsort(-scores, kind="stable"):
+        cost = costs[j] + (0 if opened[owners[j]] else CHUNK_OVERHEAD_TOKENS)
+        if used + cost <= budget:
+            keep[j] = True
+            opened[owners[j]] = True
+            used += cost
+    if not keep.any():
+        top = np.flatnonzero(owners == owners[0])
+        keep[top[np.argmax(scores[top])]] = True
+
+    context = []
+    for i, chunk in enumerate(chunks):
+        picked = np.flatnonzero(keep & (owners == i))
+        if len(picked) == 0:
+            continue
+        parts = [sentences[picked[0]]]
+        for prev, j in zip(picked, picked[1:]):
+            if j != prev + 1:
+                parts.append("…")
+            parts.append(sentences[j])
+        context.append({
+            **chunk,
+            "text": " ".join(parts),
+            "token_count": int(costs[picked].sum()),
+            "compressed": len(picked) < int((owners == i).sum()),
+        })
+    return context
@@ -0,0 +1,130 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+import numpy as np
+
+# === Persistent query-embedding cache ===
+# (normalized text, model, input_type) → float32 vector, stored as raw bytes in
+# a SQLite file so the API and the CLI scripts share it across restarts.
+# Least recently used rows are evicted once the table exceeds `max_entries`.
+
+DEFAULT_PATH = os.getenv(
+    "EMBED_CACHE_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "embed_cache.sqlite3"),
+)
+DEFAULT_MAX_ENTRIES = int(os.getenv("EMBED_CACHE_MAX_ENTRIES", "100000"))
+
+# Only rewrite last_used when it is older than this, so hits stay read-only
+TOUCH_INTERVAL = 300
+
+
+def normalize_text(text):
+    return " ".join(unicodedata.normalize("NFKC", text).split()).casefold()
+
+
+def embedding_key(text, model, input_type):
+    return hashlib.sha256(
+        f"{model}\0{input_type}\0{normalize_text(text)}".encode()
+    ).digest()
+
+
+class EmbeddingCache:
+    def __init__(self, path=DEFAULT_PATH, max_entries=DEFAULT_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._inserts = 0
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " key BLOB PRIMARY KEY,"
+            " vector BLOB NOT NULL,"
+            " last_used REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings(last_used)"
+        )
+        self._conn.commit()
+
+    def get(self, text, model, input_type):
+        return self.get_many([text], model, input_type)[0]
+
+    def get_many(self, texts, model, input_type):
+        keys = [embedding_key(t, model, input_type) for t in texts]
+        now = time.time()
+        with self._lock:
+            rows = {
+                row[0]: row[1:]
+                for row in self._conn.execute(
+                    f"SELECT key, vector, last_used FROM embeddings"
+                    f" WHERE key IN ({','.join('?' * len(keys))})",
+                    keys,
+                )
+            }
+            stale = [k for k, (_, used) in rows.items() if now - used > TOUCH_INTERVAL]
+            if stale:
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE key = ?",
+                    [(now, k) for k in stale],
+                )
+                self._conn.commit()
+            self.hits += len(rows)
+            self.misses += len(keys) - len(rows)
+
+        return [
+            np.frombuffer(rows[k][0], dtype=np.float32).tolist() if k in rows else None
+            for k in keys
+        ]
+
+    def set(self, text, model, input_type, vector):
+        self.set_many([text], model, input_type, [vector])
+
+    def set_many(self, texts, model, input_type, vectors):
+        now = time.time()
+        rows = [
+            (embedding_key(t, model, input_type), np.asarray(v, dtype=np.float32).tobytes(), now)
+            for t, v in zip(texts, vectors)
+        ]
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)",
+                rows,
+            )
+            self._inserts += len(rows)
+            if self._inserts >= 100:
+                self._inserts = 0
+                self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        (count,) = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+        excess = count - self.max_entries
+        if excess > 0:
+            self._conn.execute(
+                "DELETE FROM embeddings WHERE key IN"
+                " (SELECT key FROM embeddings ORDER BY last_used LIMIT ?)",
+                (excess,),
+            )
+
+    def stats(self):
+        with self._lock:
+            (count,) = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+            return {
+                "entries": count,
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
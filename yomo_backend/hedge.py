@@ -0,0 +1,159 @@
+import asyncio
+import time
+from collections import deque
+import numpy as np
+
+# === Hedged requests for the latency tail ===
+# The primary request gets `delay` to answer, where delay is a high
+# percentile of recently observed latencies. If it has not answered by then
+# a duplicate is sent, the first success wins and the loser is cancelled.
+#
+# Hedges are paid for with credits: every request earns `max_rate` of one
+# (capped at `burst`), every hedge spends one, so at most ~max_rate of
+# requests are ever duplicated, even when the whole upstream slows down and
+# every request crosses the delay.
+#
+# Latencies are those of the answer the caller got, measured from the
+# primary's start: when the hedge wins, that is a lower bound on what the
+# primary would have taken, which keeps the tail in the window.
+
+
+class Hedger:
+    def __init__(self, name, percentile=95.0, max_rate=0.05, min_delay=0.05, window=500,
+                 min_samples=20, burst=3.0, on_event=None):
+        self.name = name
+        self.percentile = percentile
+        self.max_rate = max_rate
+        self.min_delay = min_delay
+        self.min_samples = min_samples
+        self.burst = burst
+        self.on_event = on_event
+        self.latencies = deque(maxlen=window)
+        self.credits = 0.0
+        self.requests = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.over_budget = 0
+
+    def delay(self):
+        # No hedging until there is enough history to know what "slow" is
+        if len(self.latencies) < self.min_samples:
+            return None
+        return max(self.min_delay, float(np.percentile(self.latencies, self.percentile)))
+
+    def admit(self):
+        self.requests += 1
+        self.credits = min(self.burst, self.credits + self.max_rate)
+        return self.delay()
+
+    def spend_credit(self):
+        if self.credits >= 1.0:
+            self.credits -= 1.0
+            self.hedged += 1
+            self.event("hedged")
+            return True
+        self.over_budget += 1
+        self.event("over_budget")
+        return False
+
+    def event(self, result):
+        if self.on_event is not None:
+            self.on_event(self.name, result)
+
+    def observe(self, started):
+        self.latencies.append(time.perf_counter() - started)
+
+    # === Request / response: fn() returns an awaitable of the whole answer ===
+    async def run(self, fn):
+        delay = self.admit()
+        started = time.perf_counter()
+        attempts = [asyncio.ensure_future(fn())]
+        try:
+            if delay is not None:
+                await asyncio.wait(attempts, timeout=delay)
+                if not attempts[0].done() and self.spend_credit():
+                    attempts.append(asyncio.ensure_future(fn()))
+            winner = await first_success(attempts)
+            if winner is not attempts[0]:
+                self.hedge_wins += 1
+                self.event("hedge_won")
+            self.observe(started)
+            return winner.result()
+        finally:
+            await cancel_all(attempts)
+
+    # === Streams: open_stream() returns an async iterator of tokens ===
+    # The race is to the first token; the winning stream is then relayed.
+    async def stream(self, open_stream):
+        delay = self.admit()
+        started = time.perf_counter()
+        streams = [open_stream()]
+        attempts = [asyncio.ensure_future(streams[0].__anext__())]
+        try:
+            if delay is not None:
+                await asyncio.wait(attempts, timeout=delay)
+                if not attempts[0].done() and self.spend_credit():
+                    streams.append(open_stream())
+                    attempts.append(asyncio.ensure_future(streams[1].__anext__()))
+            winner = await first_success(attempts, StopAsyncIteration)
+            i = attempts.index(winner)
+            if i:
+                self.hedge_wins += 1
+                self.event("hedge_won")
+            self.observe(started)
+        except BaseException:
+            await cancel_all(attempts)
+            await close_all(streams)
+            raise
+
+        await cancel_all(attempts)
+        await close_all(streams[:i] + streams[i + 1:])
+        stream = streams[i]
+        try:
+            if winner.exception() is not None:  # StopAsyncIteration: an empty answer
+                return
+            yield winner.result()
+            async for token in stream:
+                yield token
+        finally:
+            await close_all([stream])
+
+    def stats(self):
+        delay = self.delay()
+        return {
+            "requests": self.requests,
+            "hedged": self.hedged,
+            "hedge_wins": self.hedge_wins,
+            "over_budget": self.over_budget,
+            "hedge_rate": self.hedged / self.requests if self.requests else 0.0,
+            "delay_ms": round(delay * 1000, 1) if delay is not None else None,
+            "samples": len(self.latencies),
+        }
+
+
+# First attempt to succeed (or to finish with one of `ok_errors`); if every
+# attempt fails, the primary's error is raised.
+async def first_success(attempts, *ok_errors):
+    pending = set(attempts)
+    while pending:
+        done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        for task in sorted(done, key=attempts.index):
+            error = task.exception()
+            if error is None or isinstance(error, ok_errors):
+                return task
+    attempts[0].result()
+
+
+async def cancel_all(tasks):
+    for task in tasks:
+        task.cancel()
+    # Let the losers unwind (close their connections) before moving on; this
+    # also collects errors of attempts that failed after the winner
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def close_all(streams):
+    for stream in streams:
+        aclose = getattr(stream, "aclose", None)
+        if aclose is not None:
+            await aclose()
@@ -1,13 +1,38 @@
+import time
+STARTED = time.perf_counter()  # import and warm-up times are reported on /ready
+
 from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from pydantic import BaseModel, Field
 from fastapi.middleware.cors import CORSMiddleware
-from typing import Dict
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional, Union
 import os
+import asyncio
 import hashlib
-import requests
 import json
+from functools import partial
 from dotenv import load_dotenv
-import cohere
+from upstream import clients
+from cache import AnswerCache, SemanticCache, STALE
+from shared_cache import SharedAnswerCache
+from embed_cache import EmbeddingCache
+from singleflight import SingleFlight
+from query_log import QueryLogger
+from timing import start_request, note_cache, stage
+import metrics
+from metrics import InFlightMiddleware, track_upstream
+from ann_index import IVFFlatIndex, fetch_supabase_rows, build_from_rows
+import quantize
+from quantize import QuantizedIndex
+from bm25 import BM25Index, reciprocal_rank_fusion
+from mmr import diversify
+from context import fit_to_budget
+from tokens import count_tokens, encoder
+import resilience
+from resilience import CircuitOpenError, UpstreamStatusError, call_async, check_status
+from hedge import Hedger
+from warmup import WarmUp
 
 # === Load environment variables ===
 load_dotenv()
@@ -17,11 +42,175 @@ CHUTES_URL = os.getenv("CHUTES_URL")
 CHUTES_API_KEY = os.getenv("CHUTES_API_KEY")
 COHERE_KEY = os.getenv("COHERE_API_KEY")
 
-# === Initialize Cohere client ===
-co = cohere.Client(COHERE_KEY)
+EMBED_MODEL = "embed-english-v3.0"
+COHERE_MAX_TEXTS = 96  # per-call limit of the Cohere embed API
+
+# === Retrieval backend: "supabase" (match_*_chunks RPC) or "local" (in-process ANN) ===
+RETRIEVAL_BACKEND = os.getenv("RETRIEVAL_BACKEND", "supabase")
+LOCAL_INDEX_DIR = os.getenv("LOCAL_INDEX_DIR", "indexes")
+ANN_NPROBE = int(os.getenv("ANN_NPROBE", "8"))
+# "none" (IVF-flat, float32) or "int8" / "binary" (quantized scan + float rescoring)
+LOCAL_INDEX_QUANTIZATION = os.getenv("LOCAL_INDEX_QUANTIZATION", "none")
+DOCTORS = ["sinclair", "longo", "huberman", "barzilai", "de_grey", "campisi"]
+
+# === Hybrid retrieval: BM25 + vectors fused with reciprocal rank fusion ===
+# When the query embedding misses its latency budget (or fails), retrieval
+# falls back to BM25 alone instead of waiting on Cohere.
+HYBRID_SEARCH = os.getenv("HYBRID_SEARCH", "true").lower() == "true"
+EMBED_LATENCY_BUDGET_MS = float(os.getenv("EMBED_LATENCY_BUDGET_MS", "1500"))
+HYBRID_CANDIDATES = int(os.getenv("HYBRID_CANDIDATES", "3"))  # per-ranking over-fetch factor
+RRF_K = int(os.getenv("RRF_K", "60"))
+# Supabase-backed BM25 indexes are rebuilt in the background once older than
+# this, so chunks added, edited or deleted by an ingestion sync drop out of
+# the lexical ranking (0: build once per process)
+LEXICAL_INDEX_TTL = float(os.getenv("LEXICAL_INDEX_TTL", "3600"))
+
+# === MMR: over-fetch candidates, keep a diverse top_k ===
+# MMR_LAMBDA = 1 is plain relevance order; lower values penalise chunks that
+# repeat what is already selected.
+MMR_ENABLED = os.getenv("MMR_ENABLED", "true").lower() == "true"
+MMR_CANDIDATES = int(os.getenv("MMR_CANDIDATES", "3"))  # over-fetch factor
+# Upper bound on the over-fetch: MMR builds a candidates x candidates
+# similarity matrix, so its cost grows with the square of this
+MMR_MAX_CANDIDATES = int(os.getenv("MMR_MAX_CANDIDATES", "150"))
+MMR_LAMBDA = float(os.getenv("MMR_LAMBDA", "0.7"))
+
+# === Prompt context budget (tokens), overridable per request ===
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "3000"))
+CONTEXT_MIN_TOKENS = int(os.getenv("CONTEXT_MIN_TOKENS", "128"))  # smallest max_context_tokens accepted
+
+# === Hedged LLM requests (off by default) ===
+# A completion (or stream) that has not answered (or sent its first token)
+# within the HEDGE_PERCENTILE of recent latencies gets a duplicate; the first
+# to answer wins. At most HEDGE_MAX_RATE of requests are duplicated.
+HEDGE_ENABLED = os.getenv("HEDGE_ENABLED", "false").lower() == "true"
+HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", "95"))
+HEDGE_MAX_RATE = float(os.getenv("HEDGE_MAX_RATE", "0.05"))
+HEDGE_MIN_DELAY_MS = float(os.getenv("HEDGE_MIN_DELAY_MS", "50"))
+HEDGE_WINDOW = int(os.getenv("HEDGE_WINDOW", "500"))  # recent latencies the percentile is taken over
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", "20"))
+
+# === Startup warm-up: /ready turns 200 once it has finished ===
+WARMUP_ENABLED = os.getenv("WARMUP_ENABLED", "true").lower() == "true"
+WARMUP_EMBED = os.getenv("WARMUP_EMBED", "true").lower() == "true"  # one real Cohere call
+WARMUP_CONNECTIONS = int(os.getenv("WARMUP_CONNECTIONS", "2"))  # pre-opened per Supabase / Chutes pool
+WARMUP_QUERY = os.getenv("WARMUP_QUERY", "What can slow down aging?")
+
+# === uvicorn worker processes (uvicorn reads WEB_CONCURRENCY when --workers is not given) ===
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "1"))
+
+# === Answer cache bounds ===
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "2048"))
+ANSWER_CACHE_MAX_BYTES = int(os.getenv("ANSWER_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "86400"))
+ANSWER_CACHE_STALE_TTL = float(os.getenv("ANSWER_CACHE_STALE_TTL", "3600"))
+# "memory" (per process) or "sqlite" (ANSWER_CACHE_PATH, shared by every
+# worker on the host and kept across restarts); sqlite by default when
+# uvicorn runs more than one worker
+ANSWER_CACHE_BACKEND = os.getenv(
+    "ANSWER_CACHE_BACKEND", "sqlite" if WEB_CONCURRENCY > 1 else "memory"
+).lower()
+
+# === Semantic cache: reuse answers for paraphrased questions ===
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE_ENABLED", "true").lower() == "true"
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.92"))
+SEMANTIC_CACHE_CAPACITY = int(os.getenv("SEMANTIC_CACHE_CAPACITY", "512"))
+
+# === Per-request retrieval limit: top_k / per_doctor_k above it get a 422 ===
+TOP_K_MAX = int(os.getenv("TOP_K_MAX", "50"))
+
+# === Batch endpoint limits ===
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "500"))
+BATCH_PARALLELISM = int(os.getenv("BATCH_PARALLELISM", "8"))
+BATCH_MAX_PARALLELISM = int(os.getenv("BATCH_MAX_PARALLELISM", "32"))
+
+# === Structured query log (JSON Lines, rotated by size) ===
+QUERY_LOG_PATH = os.getenv("QUERY_LOG_PATH", "query_log.jsonl")
+QUERY_LOG_MAX_BYTES = int(os.getenv("QUERY_LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+QUERY_LOG_BACKUPS = int(os.getenv("QUERY_LOG_BACKUPS", "5"))
+QUERY_LOG_QUEUE_SIZE = int(os.getenv("QUERY_LOG_QUEUE_SIZE", "10000"))
+
+# === Slow-request log: stage breakdown of requests above the threshold ===
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", "10000"))
+SLOW_LOG_PATH = os.getenv("SLOW_LOG_PATH", "slow_requests.jsonl")
+
+# === Startup setting checks ===
+# Misconfigured choices fail startup (so the deploy never reports ready)
+# instead of the first request that reaches them
+def check_settings():
+    choices = {
+        "RETRIEVAL_BACKEND": (RETRIEVAL_BACKEND, ("supabase", "local")),
+        "LOCAL_INDEX_QUANTIZATION": (LOCAL_INDEX_QUANTIZATION, ("none",) + quantize.MODES),
+        "ANSWER_CACHE_BACKEND": (ANSWER_CACHE_BACKEND, ("memory", "sqlite")),
+    }
+    for name, (value, allowed) in choices.items():
+        if value not in allowed:
+            raise ValueError(f"{name}={value!r}; expected one of {', '.join(allowed)}")
+
+# === Pooled upstream clients live for the lifetime of the app ===
+@asynccontextmanager
+async def lifespan(app):
+    check_settings()
+    await clients.open(COHERE_KEY, SUPABASE_URL, SUPABASE_KEY, CHUTES_API_KEY)
+    query_logger.start()
+    slow_logger.start()
+    startup.start(warmup_steps() if WARMUP_ENABLED else {})
+    try:
+        yield
+    finally:
+        await startup.stop()
+        await clients.close()
+        query_logger.stop()
+        slow_logger.stop()
+        if isinstance(cache, SharedAnswerCache):
+            cache.close()
+        embed_cache.close()
+
+# === Warm-up: everything the first request would otherwise pay for ===
+# Runs in the background after startup; steps are independent and concurrent.
+def warmup_steps():
+    steps = {
+        "cohere": warm_cohere,
+        "tokenizer": lambda: asyncio.to_thread(encoder),
+        "kernels": lambda: asyncio.to_thread(warm_kernels),
+        "embed_cache": lambda: asyncio.to_thread(embed_cache.get, WARMUP_QUERY, EMBED_MODEL, "search_query"),
+    }
+    if SUPABASE_URL:
+        steps["supabase_pool"] = lambda: open_connections(
+            clients.supabase, "GET", f"/rest/v1/{DOCTORS[0]}_chunks", params={"select": "id", "limit": "1"}
+        )
+    if CHUTES_URL:
+        steps["chutes_pool"] = lambda: open_connections(clients.chutes, "HEAD", CHUTES_URL)
+    for doctor in DOCTORS:
+        if RETRIEVAL_BACKEND == "local":
+            steps[f"local_index:{doctor}"] = partial(get_local_index, doctor)
+        if HYBRID_SEARCH:
+            steps[f"lexical_index:{doctor}"] = partial(get_lexical_index, doctor)
+    return steps
+
+# Builds the Cohere SDK client off the event loop, then one real embed opens
+# (and keeps) the first pooled connection
+async def warm_cohere():
+    await asyncio.to_thread(lambda: clients.cohere)
+    if WARMUP_EMBED:
+        await call_upstream("cohere", lambda: clients.cohere.embed(
+            texts=[WARMUP_QUERY],
+            model=EMBED_MODEL,
+            input_type="search_query"
+        ))
+
+# Any response means the TCP + TLS connection is up and back in the pool
+async def open_connections(client, method, url, **kwargs):
+    await asyncio.gather(*[client.request(method, url, **kwargs) for _ in range(WARMUP_CONNECTIONS)])
+
+# First calls into MMR and context assembly compile regexes and warm numpy
+def warm_kernels():
+    text = " ".join(f"{WARMUP_QUERY} Sentence {i}." for i in range(20))
+    chunks = [{"id": i, "title": "warm-up", "text": text, "similarity": 1.0 - i / 10} for i in range(8)]
+    fit_to_budget(WARMUP_QUERY, diversify(chunks, 4, MMR_LAMBDA), 64)
 
 # === FastAPI app ===
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -30,58 +219,397 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(InFlightMiddleware)
 
-# === In-memory cache ===
-cache: Dict[str, Dict] = {}
+# === Local ANN indexes, one per doctor ===
+local_indexes: Dict[str, Union[IVFFlatIndex, QuantizedIndex]] = {}
+index_locks = {doctor: asyncio.Lock() for doctor in DOCTORS}
+lexical_indexes: Dict[str, BM25Index] = {}
+lexical_built: Dict[str, float] = {}
+lexical_locks = {doctor: asyncio.Lock() for doctor in DOCTORS}
+
+# === Answer cache (LRU + TTL, stale-while-revalidate) ===
+cache = (SharedAnswerCache if ANSWER_CACHE_BACKEND == "sqlite" else AnswerCache)(
+    max_entries=ANSWER_CACHE_MAX_ENTRIES,
+    max_bytes=ANSWER_CACHE_MAX_BYTES,
+    ttl=ANSWER_CACHE_TTL,
+    stale_ttl=ANSWER_CACHE_STALE_TTL,
+)
+
+# The SQLite backend does disk I/O and can wait on another worker's write
+# lock, so its calls run in a thread, as the embedding cache's do; the
+# in-memory cache is called inline
+async def cache_call(fn, *args):
+    if isinstance(cache, SharedAnswerCache):
+        return await asyncio.to_thread(fn, *args)
+    return fn(*args)
+
+semantic_cache = SemanticCache(
+    threshold=SEMANTIC_CACHE_THRESHOLD,
+    capacity=SEMANTIC_CACHE_CAPACITY,
+    ttl=ANSWER_CACHE_TTL,
+)
+background_tasks = set()
+
+# === Background query log writer ===
+# With several workers each process writes and rotates its own files
+# (query_log.<pid>.jsonl), so no two processes rotate the same one
+def worker_log_path(path):
+    if WEB_CONCURRENCY <= 1:
+        return path
+    root, ext = os.path.splitext(path)
+    return f"{root}.{os.getpid()}{ext}"
+
+query_logger = QueryLogger(
+    worker_log_path(QUERY_LOG_PATH),
+    max_bytes=QUERY_LOG_MAX_BYTES,
+    backups=QUERY_LOG_BACKUPS,
+    queue_size=QUERY_LOG_QUEUE_SIZE,
+)
+slow_logger = QueryLogger(worker_log_path(SLOW_LOG_PATH), max_bytes=QUERY_LOG_MAX_BYTES, backups=QUERY_LOG_BACKUPS)
+
+# === LLM hedging: one latency history for full completions, one for time to first token ===
+def make_hedger(kind):
+    return Hedger(
+        kind,
+        percentile=HEDGE_PERCENTILE,
+        max_rate=HEDGE_MAX_RATE,
+        min_delay=HEDGE_MIN_DELAY_MS / 1000,
+        window=HEDGE_WINDOW,
+        min_samples=HEDGE_MIN_SAMPLES,
+        on_event=metrics.hedged_requests.inc,
+    )
+
+completion_hedger = make_hedger("completion")
+first_token_hedger = make_hedger("first_token")
+
+# === Startup report (/ready) ===
+startup = WarmUp(STARTED)
+
+# === Concurrent identical questions share one in-flight pipeline ===
+inflight = SingleFlight()
+
+# === Disk-backed query-embedding cache (EMBED_CACHE_PATH), shared with the CLI scripts ===
+embed_cache = EmbeddingCache()
 
 # === Request schema ===
 class QuestionRequest(BaseModel):
     question: str
-    top_k: int = 5
+    top_k: int = Field(5, ge=1, le=TOP_K_MAX)
     doctor: str = "sinclair"
+    max_context_tokens: Optional[int] = Field(None, ge=CONTEXT_MIN_TOKENS)
+
+class FanOutRequest(BaseModel):
+    question: str
+    doctors: List[str] = DOCTORS
+    top_k: int = Field(5, ge=1, le=TOP_K_MAX)
+    per_doctor_k: int = Field(3, ge=1, le=TOP_K_MAX)
+    mode: str = "combined"  # "combined" (one panel answer) or "per_doctor"
+    max_context_tokens: Optional[int] = Field(None, ge=CONTEXT_MIN_TOKENS)
+
+class BatchRequest(BaseModel):
+    items: List[QuestionRequest]
+    parallelism: Optional[int] = None
 
 @app.get("/")
 def root():
     return {"message": "Welcome to the Doctor GPT RAG API!"}
 
+# Liveness: the process is up. Readiness: warm-up has finished, so the
+# first request does not pay for cold connections, indexes or imports.
 @app.get("/health")
 def health_check():
     return {"status": "ok"}
 
+@app.get("/ready")
+def readiness_check():
+    return JSONResponse(startup.status(), status_code=200 if startup.ready else 503)
+
+@app.get("/cache/stats")
+def cache_stats():
+    return {
+        **cache.stats(),
+        "semantic": semantic_cache.stats(),
+        "embeddings": embed_cache.stats(),
+        "in_flight": len(inflight),
+        "coalesced": inflight.coalesced,
+        "query_log": query_logger.stats(),
+        "slow_log": slow_logger.stats(),
+    }
+
+@app.get("/upstreams")
+def upstream_status():
+    return {
+        "breakers": resilience.snapshot(),
+        "hedging": {
+            "enabled": HEDGE_ENABLED,
+            "completion": completion_hedger.stats(),
+            "first_token": first_token_hedger.stats(),
+        },
+    }
+
+@app.get("/metrics")
+def prometheus_metrics():
+    for service, state in resilience.snapshot().items():
+        metrics.circuit_state.set(service, value=CIRCUIT_STATES[state["state"]])
+    for log, logger in (("query", query_logger), ("slow", slow_logger)):
+        metrics.query_log_written.set(log, value=logger.written)
+        metrics.query_log_dropped.set(log, value=logger.dropped)
+    return PlainTextResponse(metrics.registry.render(), media_type="text/plain; version=0.0.4")
+
+# === Upstream calls: per-service timeouts (upstream.py), bounded retries and a circuit breaker ===
+# An open breaker fails the call at once with CircuitOpenError, which the
+# endpoints answer with 503 instead of queueing behind a dead upstream.
+CIRCUIT_STATES = {resilience.CLOSED: 0, resilience.HALF_OPEN: 1, resilience.OPEN: 2}
+
+async def call_upstream(service, fn, retryable=resilience.is_retryable):
+    with track_upstream(service):
+        return await call_async(service, fn, on_retry=metrics.upstream_retries.inc, retryable=retryable)
+
+# The doctor names a table, an RPC and an index directory: only known ones get that far
+def check_doctor(doctor):
+    if doctor not in DOCTORS:
+        raise HTTPException(status_code=400, detail=f"Unknown doctor {doctor!r}; expected one of {', '.join(DOCTORS)}")
+
+def upstream_error(e):
+    if isinstance(e, CircuitOpenError):
+        return HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(int(e.retry_in) + 1)})
+    return HTTPException(status_code=500, detail=str(e))
+
 # === Embedding via Cohere ===
-def embed_query(query):
-    response = co.embed(
-        texts=[query],
-        model="embed-english-v3.0",
-        input_type="search_query"
+async def embed_queries(queries):
+    # Repeated questions (e.g. within a batch) are embedded once
+    unique = list(dict.fromkeys(queries))
+    if len(unique) < len(queries):
+        by_query = dict(zip(unique, await embed_queries(unique)))
+        return [by_query[q] for q in queries]
+
+    embeddings = await asyncio.to_thread(
+        embed_cache.get_many, queries, EMBED_MODEL, "search_query"
     )
-    return response.embeddings[0]
+    missing = [i for i, e in enumerate(embeddings) if e is None]
+
+    async def embed_batch(batch):
+        texts = [queries[i] for i in batch]
+        response = await call_upstream("cohere", lambda: clients.cohere.embed(
+            texts=texts,
+            model=EMBED_MODEL,
+            input_type="search_query"
+        ))
+        for i, embedding in zip(batch, response.embeddings):
+            embeddings[i] = embedding
+        await asyncio.to_thread(
+            embed_cache.set_many, texts, EMBED_MODEL, "search_query", response.embeddings
+        )
+
+    await asyncio.gather(*[
+        embed_batch(missing[start:start + COHERE_MAX_TEXTS])
+        for start in range(0, len(missing), COHERE_MAX_TEXTS)
+    ])
+    return embeddings
+
+async def embed_query(query):
+    return (await embed_queries([query]))[0]
+
+# Returns None when hybrid search is on and the embedding is late or fails;
+# callers then retrieve with BM25 alone. A late embedding keeps running in
+# the background so it lands in the embedding cache for the next ask.
+async def embed_query_within_budget(query):
+    if not HYBRID_SEARCH:
+        return await embed_query(query)
+
+    task = asyncio.ensure_future(embed_query(query))
+    try:
+        return await asyncio.wait_for(asyncio.shield(task), EMBED_LATENCY_BUDGET_MS / 1000)
+    except asyncio.TimeoutError:
+        background_tasks.add(task)
+        task.add_done_callback(background_tasks.discard)
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        metrics.lexical_fallbacks.inc("timeout")
+    except CircuitOpenError:
+        metrics.lexical_fallbacks.inc("circuit_open")
+    except Exception as e:
+        print(f"⚠️ Query embedding failed, falling back to BM25: {e}")
+        metrics.lexical_fallbacks.inc("error")
+    return None
 
 # === Supabase vector similarity search ===
-def search_supabase(query_embedding, doctor, top_k):
+async def search_supabase(query_embedding, doctor, top_k):
     function_name = f"match_{doctor}_chunks"
-    url = f"{SUPABASE_URL}/rest/v1/rpc/{function_name}"
-
-    headers = {
-        'apikey': SUPABASE_KEY,
-        'Authorization': f'Bearer {SUPABASE_KEY}',
-        'Content-Type': 'application/json'
-    }
 
     payload = {
         "query_embedding": query_embedding,
         "match_count": top_k
     }
 
-    res = requests.post(url, headers=headers, json=payload)
+    async def request():
+        return check_status("supabase", await clients.supabase.post(f"/rest/v1/rpc/{function_name}", json=payload))
 
+    res = await call_upstream("supabase", request)
     if res.status_code != 200:
         raise Exception(f"Supabase function error: {res.text}")
 
     return res.json()
 
+# === Local ANN search ===
+async def load_local_index(doctor):
+    path = os.path.join(LOCAL_INDEX_DIR, doctor)
+    mode = LOCAL_INDEX_QUANTIZATION
+    if mode != "none" and QuantizedIndex.exists(path, mode):
+        index = await asyncio.to_thread(QuantizedIndex.load, path, mode)
+    elif mode == "none" and IVFFlatIndex.exists(path):
+        index = await asyncio.to_thread(IVFFlatIndex.load, path, ANN_NPROBE)
+    else:
+        with track_upstream("supabase"):
+            rows = await fetch_supabase_rows(clients.supabase, f"{doctor}_chunks", on_retry=metrics.upstream_retries.inc)
+        await asyncio.to_thread(add_token_counts, rows)
+        if mode != "none":
+            index = await asyncio.to_thread(quantize.build_from_rows, rows, mode)
+        else:
+            index = await asyncio.to_thread(build_from_rows, rows, None, ANN_NPROBE)
+        await asyncio.to_thread(index.save, path)
+    local_indexes[doctor] = index
+    return index
+
+# Counted once when the index is built and stored in its records, so
+# context assembly never re-tokenizes a chunk that fits the budget
+def add_token_counts(rows):
+    for row in rows:
+        if row.get("token_count") is None:
+            row["token_count"] = count_tokens(row["text"])
+
+async def get_local_index(doctor):
+    index = local_indexes.get(doctor)
+    if index is None:
+        async with index_locks[doctor]:
+            index = local_indexes.get(doctor) or await load_local_index(doctor)
+    return index
+
+async def search_local(query_embedding, doctor, top_k):
+    index = await get_local_index(doctor)
+    return await asyncio.to_thread(index.search, query_embedding, top_k, with_vectors=MMR_ENABLED)
+
+async def search_vectors(query_embedding, doctor, top_k):
+    if RETRIEVAL_BACKEND == "local":
+        return await search_local(query_embedding, doctor, top_k)
+    return await search_supabase(query_embedding, doctor, top_k)
+
+# === Local BM25 search, built from the same chunks as the vector indexes ===
+async def load_lexical_index(doctor):
+    if RETRIEVAL_BACKEND == "local":
+        vector_index = await get_local_index(doctor)
+        records = await asyncio.to_thread(list, vector_index.iter_records())
+    else:
+        with track_upstream("supabase"):
+            records = await fetch_supabase_rows(
+                clients.supabase, f"{doctor}_chunks", columns="id,title,text", on_retry=metrics.upstream_retries.inc
+            )
+        await asyncio.to_thread(add_token_counts, records)
+    index = await asyncio.to_thread(BM25Index().build, records)
+    lexical_indexes[doctor] = index
+    lexical_built[doctor] = time.monotonic()
+    return index
+
+# A local-backend index is built from the on-disk ANN records, which do not
+# change while the process runs, so only Supabase-backed ones expire
+def lexical_index_expired(doctor):
+    return (
+        LEXICAL_INDEX_TTL > 0 and RETRIEVAL_BACKEND != "local"
+        and time.monotonic() - lexical_built.get(doctor, 0.0) > LEXICAL_INDEX_TTL
+    )
+
+async def get_lexical_index(doctor):
+    index = lexical_indexes.get(doctor)
+    if index is None:
+        async with lexical_locks[doctor]:
+            index = lexical_indexes.get(doctor) or await load_lexical_index(doctor)
+    elif lexical_index_expired(doctor) and not lexical_locks[doctor].locked():
+        # Keep serving the current index while the new one is built
+        task = asyncio.create_task(reload_lexical_index(doctor))
+        background_tasks.add(task)
+        task.add_done_callback(background_tasks.discard)
+    return index
+
+async def reload_lexical_index(doctor):
+    async with lexical_locks[doctor]:
+        if not lexical_index_expired(doctor):
+            return
+        try:
+            await load_lexical_index(doctor)
+        except Exception as e:
+            # Keep the old index and try again after another TTL
+            lexical_built[doctor] = time.monotonic()
+            print(f"⚠️ BM25 index rebuild for {doctor} failed: {e}")
+
+async def search_lexical(question, doctor, top_k):
+    index = await get_lexical_index(doctor)
+    return await asyncio.to_thread(index.search, question, top_k)
+
+def candidate_count(top_k):
+    if not MMR_ENABLED:
+        return top_k
+    return max(top_k, min(top_k * MMR_CANDIDATES, MMR_MAX_CANDIDATES))
+
+async def search_chunks(query_embedding, doctor, top_k, question=None):
+    chunks = await retrieve_candidates(query_embedding, doctor, candidate_count(top_k), question)
+    if not MMR_ENABLED:
+        return chunks
+    return await asyncio.to_thread(diversify, chunks, top_k, MMR_LAMBDA)
+
+# query_embedding None means BM25 only; without a question it is vectors only
+async def retrieve_candidates(query_embedding, doctor, top_k, question=None):
+    if not (HYBRID_SEARCH and question):
+        return await search_vectors(query_embedding, doctor, top_k)
+    if query_embedding is None:
+        return await search_lexical(question, doctor, top_k)
+
+    vector_hits, lexical_hits = await asyncio.gather(
+        search_vectors(query_embedding, doctor, top_k * HYBRID_CANDIDATES),
+        search_lexical(question, doctor, top_k * HYBRID_CANDIDATES),
+        return_exceptions=True,
+    )
+    return fuse_rankings(doctor, top_k, vector_hits, lexical_hits)
+
+def fuse_rankings(doctor, top_k, vector_hits, lexical_hits):
+    if isinstance(vector_hits, Exception):
+        raise vector_hits
+    if isinstance(lexical_hits, Exception):
+        print(f"⚠️ BM25 search for {doctor} failed, using vectors only: {lexical_hits}")
+        return vector_hits[:top_k]
+    return reciprocal_rank_fusion([vector_hits, lexical_hits], top_k, RRF_K)
+
+# === Batched retrieval: returns a chunk list or an exception per query ===
+async def search_chunks_batch(query_embeddings, doctors, top_ks):
+    if RETRIEVAL_BACKEND != "local":
+        return await asyncio.gather(
+            *[search_supabase(e, d, k) for e, d, k in zip(query_embeddings, doctors, top_ks)],
+            return_exceptions=True,
+        )
+
+    # One matrix product per doctor instead of one search per question
+    results = [None] * len(query_embeddings)
+    by_doctor = {}
+    for i, doctor in enumerate(doctors):
+        by_doctor.setdefault(doctor, []).append(i)
+
+    for doctor, items in by_doctor.items():
+        try:
+            index = await get_local_index(doctor)
+            hits = await asyncio.to_thread(
+                index.search_batch,
+                [query_embeddings[i] for i in items],
+                max(top_ks[i] for i in items),
+                with_vectors=MMR_ENABLED,
+            )
+            for i, chunks in zip(items, hits):
+                results[i] = chunks[:top_ks[i]]
+        except Exception as e:
+            for i in items:
+                results[i] = e
+    return results
+
 # === DeepSeek-V3 via Chutes ===
-def generate_answer(question, context_chunks, doctor):
+def build_prompt(question, context_chunks, doctor):
     context = "\n\n".join([chunk["text"] for chunk in context_chunks])
 
     prompt = f"""
@@ -100,11 +628,32 @@ QUESTION:
 
 ANSWER:
 """
+    return prompt
 
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {CHUTES_API_KEY}"
-    }
+def build_panel_prompt(question, context_chunks):
+    context = "\n\n".join(
+        [f"[Dr. {chunk['doctor'].capitalize()}] {chunk['text']}" for chunk in context_chunks]
+    )
+
+    prompt = f"""
+You are moderating a panel of world-renowned experts in health and wellness.
+
+Answer the following QUESTION based on the CONTEXT below, where each passage is labelled with the expert it comes from. Compare the experts' views, attribute each point to the expert who made it, and note where they agree or disagree.
+
+- If the user makes a typo or vague reference, use intelligent inference to guess what they meant and answer accordingly.
+- If something is not directly in the context, provide a helpful, educated response without claiming certainty.
+
+CONTEXT:
+{context}
+
+QUESTION:
+{question}
+
+ANSWER:
+"""
+    return prompt
+
+def chat_payload(prompt, stream=False):
     payload = {
         "model": "deepseek-ai/DeepSeek-V3-0324",
         "messages": [
@@ -114,37 +663,555 @@ ANSWER:
         "temperature": 0.3,
         "max_tokens": 500
     }
+    if stream:
+        payload["stream"] = True
+    return payload
 
-    response = requests.post(CHUTES_URL, headers=headers, json=payload)
+def build_payload(question, context_chunks, doctor, stream=False):
+    return chat_payload(build_prompt(question, context_chunks, doctor), stream)
 
+async def complete(payload):
+    async def request():
+        return check_status("chutes", await clients.chutes.post(CHUTES_URL, json=payload))
+
+    call = partial(call_upstream, "chutes", request, retryable=resilience.is_retryable_fast)
+    if HEDGE_ENABLED:
+        response = await completion_hedger.run(call)
+    else:
+        response = await call()
     if response.status_code != 200:
         raise Exception(f"Chutes API error: {response.text}")
 
     return response.json()["choices"][0]["message"]["content"]
 
+async def generate_answer(question, context_chunks, doctor):
+    return await complete(build_payload(question, context_chunks, doctor))
+
+async def generate_panel_answer(question, context_chunks):
+    return await complete(chat_payload(build_panel_prompt(question, context_chunks)))
+
+# === DeepSeek-V3 via Chutes, token by token (OpenAI-compatible SSE) ===
+async def stream_answer(question, context_chunks, doctor):
+    payload = build_payload(question, context_chunks, doctor, stream=True)
+
+    if HEDGE_ENABLED:
+        tokens = first_token_hedger.stream(lambda: stream_completion(payload))
+    else:
+        tokens = stream_completion(payload)
+    with track_upstream("chutes"):
+        async for token in tokens:
+            yield token
+
+# Retried only until Chutes answers 200: after that tokens may already be on
+# their way to the client and the stream cannot be restarted. Read timeouts
+# are not retried, as for a plain completion. The breaker sees that first
+# outcome.
+async def stream_completion(payload):
+    breaker = resilience.breakers["chutes"]
+    breaker.before_call()
+    for attempt in range(resilience.RETRY_ATTEMPTS):
+        started = False
+        try:
+            async with clients.chutes.stream("POST", CHUTES_URL, json=payload) as response:
+                if response.status_code != 200:
+                    body = (await response.aread()).decode(errors="replace")
+                    if response.status_code in resilience.RETRYABLE_STATUSES:
+                        raise UpstreamStatusError("chutes", response.status_code, body, response.headers)
+                    raise Exception(f"Chutes API error: {body}")
+                breaker.record_success()
+                started = True
+                async for token in sse_tokens(response):
+                    yield token
+            return
+        except Exception as e:
+            if started:
+                raise
+            if not resilience.is_retryable_fast(e) or attempt == resilience.RETRY_ATTEMPTS - 1:
+                resilience.record_outcome(breaker, e)
+                raise
+            resilience.note_retry(breaker, metrics.upstream_retries.inc)
+            await asyncio.sleep(resilience.backoff_delay(attempt, resilience.retry_after_seconds(e)))
+        except BaseException:  # cancelled or the client went away
+            if not started:
+                breaker.release()
+            raise
+
+async def sse_tokens(response):
+    async for line in response.aiter_lines():
+        if not line.startswith("data:"):
+            continue
+        data = line[len("data:"):].strip()
+        if data == "[DONE]":
+            break
+        choices = json.loads(data).get("choices") or []
+        if not choices:
+            continue
+        token = (choices[0].get("delta") or {}).get("content")
+        if token:
+            yield token
+
+# === Query log: enqueue only, the writer thread does the disk I/O ===
+# Also feeds the /metrics histograms and the slow-request log, unless
+# timed=False (batch items: the batch's latency is recorded once, see log_batch)
+def log_query(trace, endpoint, doctor, question, top_k, answer=None, error=None, timed=True):
+    timings = {**trace.timings, "total": trace.total_ms()}
+    query_logger.log(
+        endpoint=endpoint,
+        doctor=doctor,
+        question=question,
+        answer=answer,
+        cache_hit=trace.cache is not None,
+        cache=trace.cache,
+        top_k=top_k,
+        timings=timings,
+        error=error,
+    )
+
+    # Bound label cardinality: unknown doctors and panels share a label
+    doctor_label = doctor if doctor in DOCTORS else ("panel" if "," in doctor else "other")
+    metrics.observe_request(
+        endpoint, doctor_label, "error" if error else "ok", trace.cache, timings if timed else None
+    )
+
+    if timed and timings["total"] >= SLOW_REQUEST_MS:
+        slow_logger.log(
+            endpoint=endpoint,
+            doctor=doctor,
+            question=question,
+            cache=trace.cache,
+            top_k=top_k,
+            timings=timings,
+            error=error,
+        )
+
+def log_batch(trace, items):
+    timings = {**trace.timings, "total": trace.total_ms()}
+    doctors = {item.doctor for item in items}
+    doctor_label = doctors.pop() if len(doctors) == 1 else "mixed"
+    metrics.observe_latency("/ask/batch", doctor_label, timings)
+    if timings["total"] >= SLOW_REQUEST_MS:
+        slow_logger.log(endpoint="/ask/batch", doctor=doctor_label, items=len(items), timings=timings)
+
+def cache_key(doctor, question):
+    return hashlib.sha256(f"{doctor}|{question}".encode()).hexdigest()
+
+def format_sources(chunks):
+    return [{"text": c["text"][:120] + "..."} for c in chunks]
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+# === Prompt context within the token budget ===
+async def assemble_context(question, chunks, budget=None):
+    with stage("context"):
+        return await asyncio.to_thread(fit_to_budget, question, chunks, budget or CONTEXT_TOKEN_BUDGET)
+
+# === Full RAG pipeline: embed → retrieve → generate ===
+# query_embedding=None is a real value (BM25-only retrieval), so "embed the
+# question here" is a separate sentinel.
+EMBED = object()
+
+async def run_pipeline(question, doctor, top_k, query_embedding=EMBED, budget=None):
+    if query_embedding is EMBED:
+        with stage("embed"):
+            query_embedding = await embed_query_within_budget(question)
+    with stage("search"):
+        chunks = await search_chunks(query_embedding, doctor, top_k, question)
+    chunks = await assemble_context(question, chunks, budget)
+    with stage("generate"):
+        answer = await generate_answer(question, chunks, doctor)
+    return {"answer": answer, "sources": format_sources(chunks)}
+
+async def semantic_lookup(key, doctor, query_embedding):
+    if not SEMANTIC_CACHE_ENABLED or query_embedding is None:
+        return None
+    cached = semantic_cache.get(doctor, query_embedding)
+    if cached is not None:
+        note_cache("semantic")
+        # Another worker may have stored the exact answer meanwhile: keep it
+        cached, _ = await cache_call(cache.get_or_set, key, cached)
+    return cached
+
+async def store_answer(key, doctor, query_embedding, result):
+    await cache_call(cache.set, key, result)
+    if SEMANTIC_CACHE_ENABLED and query_embedding is not None:
+        semantic_cache.set(doctor, query_embedding, result)
+
+# === Stale-while-revalidate: refresh a stale entry off the request path ===
+# `refresh` recomputes the answer and stores it in the cache itself.
+async def refresh_cached(key, label, refresh):
+    try:
+        await inflight.do(key, refresh)
+    except Exception as e:
+        print(f"⚠️ Background refresh failed for {label}: {e}")
+    finally:
+        await cache_call(cache.end_refresh, key)
+
+async def revalidate(key, label, refresh):
+    if await cache_call(cache.begin_refresh, key):
+        task = asyncio.create_task(refresh_cached(key, label, refresh))
+        background_tasks.add(task)
+        task.add_done_callback(background_tasks.discard)
+
+async def refresh_answer(key, request):
+    result = await run_pipeline(
+        request.question, request.doctor, request.top_k, budget=request.max_context_tokens
+    )
+    await cache_call(cache.set, key, result)
+
+async def run_and_store(key, question, doctor, top_k, query_embedding, budget=None):
+    result = await run_pipeline(question, doctor, top_k, query_embedding, budget)
+
+    await store_answer(key, doctor, query_embedding, result)
+    return result
+
+async def answer_uncached(key, request):
+    with stage("embed"):
+        query_embedding = await embed_query_within_budget(request.question)
+    cached = await semantic_lookup(key, request.doctor, query_embedding)
+    if cached is not None:
+        return cached
+
+    return await run_and_store(
+        key, request.question, request.doctor, request.top_k, query_embedding,
+        request.max_context_tokens,
+    )
+
 # === Ask endpoint ===
 @app.post("/ask")
-def ask_question(request: QuestionRequest):
+async def ask_question(request: QuestionRequest):
+    check_doctor(request.doctor)
+    trace = start_request()
     try:
-        key = hashlib.sha256(f"{request.doctor}|{request.question}".encode()).hexdigest()
-        if key in cache:
-            return cache[key]
+        key = cache_key(request.doctor, request.question)
+        cached, state = await cache_call(cache.get, key)
+        if cached is not None:
+            if state == STALE:
+                await revalidate(key, request.doctor, partial(refresh_answer, key, request))
+            trace.cache = "exact"
+            result = cached
+        else:
+            result = await inflight.do(key, lambda: answer_uncached(key, request))
+
+        log_query(trace, "/ask", request.doctor, request.question, request.top_k, result["answer"])
+        return result
+
+    except Exception as e:
+        log_query(trace, "/ask", request.doctor, request.question, request.top_k, error=str(e))
+        raise upstream_error(e)
+
+# === Batch ask endpoint ===
+# Cached items are answered directly; the rest are embedded together, retrieved
+# in one batched step and generated concurrently. Results keep request order;
+# failed items carry {"error": ...} instead of an answer.
+@app.post("/ask/batch")
+async def ask_batch(request: BatchRequest):
+    items = request.items
+    if len(items) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"At most {BATCH_MAX_ITEMS} items per batch")
+    for item in items:
+        check_doctor(item.doctor)
+
+    trace = start_request()
+    results = [None] * len(items)
+    keys = [cache_key(item.doctor, item.question) for item in items]
+    cache_kinds = [None] * len(items)
 
-        query_embedding = embed_query(request.question)
-        chunks = search_supabase(query_embedding, request.doctor, request.top_k)
-        answer = generate_answer(request.question, chunks, request.doctor)
+    pending = []
+    lookups = await cache_call(lambda: [cache.get(key) for key in keys])
+    for i, (item, key, (cached, state)) in enumerate(zip(items, keys, lookups)):
+        if cached is not None:
+            if state == STALE:
+                await revalidate(key, item.doctor, partial(refresh_answer, key, item))
+            results[i] = cached
+            cache_kinds[i] = "exact"
+        else:
+            pending.append(i)
 
-        sources = [{"text": c["text"][:120] + "..."} for c in chunks]
-        result = {"answer": answer, "sources": sources}
+    if pending:
+        await answer_batch_misses(request, pending, keys, results, cache_kinds)
 
-        cache[key] = result
+    for i, (item, result) in enumerate(zip(items, results)):
+        trace.cache = cache_kinds[i]
+        log_query(
+            trace, "/ask/batch", item.doctor, item.question, item.top_k,
+            answer=result.get("answer"), error=result.get("error"), timed=False,
+        )
+    log_batch(trace, items)
+    return {"results": results}
 
-        with open("query_log.txt", "a") as log_file:
-            log_file.write(f"Doctor: {request.doctor}\n")
-            log_file.write(f"Q: {request.question}\n")
-            log_file.write(f"A: {answer}\n\n")
+# Vector search for all items in one batched step, fused with BM25 when hybrid
+async def retrieve_batch(items, to_search, fetch_ks):
+    retrieved = await search_chunks_batch(
+        [embedding for _, embedding in to_search],
+        [items[i].doctor for i, _ in to_search],
+        [k * (HYBRID_CANDIDATES if HYBRID_SEARCH else 1) for k in fetch_ks],
+    )
+    if not HYBRID_SEARCH:
+        return retrieved
+    lexical = await asyncio.gather(*[
+        search_lexical(items[i].question, items[i].doctor, k * HYBRID_CANDIDATES)
+        for (i, _), k in zip(to_search, fetch_ks)
+    ], return_exceptions=True)
+    return [
+        chunks if isinstance(chunks, Exception)
+        else fuse_rankings(items[i].doctor, k, chunks, lexical_hits)
+        for (i, _), k, chunks, lexical_hits in zip(to_search, fetch_ks, retrieved, lexical)
+    ]
 
+async def answer_batch_misses(request, pending, keys, results, cache_kinds):
+    items = request.items
+    lexical_only = False
+    try:
+        with stage("embed"):
+            embeddings = await embed_queries([items[i].question for i in pending])
+    except Exception as e:
+        if not HYBRID_SEARCH:
+            for i in pending:
+                results[i] = {"error": str(e)}
+            return
+        # As for a single ask: every item is retrieved with BM25 alone
+        print(f"⚠️ Batch embedding failed, falling back to BM25: {e}")
+        metrics.lexical_fallbacks.inc("circuit_open" if isinstance(e, CircuitOpenError) else "error")
+        embeddings = [None] * len(pending)
+        lexical_only = True
+
+    to_search = []
+    for i, embedding in zip(pending, embeddings):
+        cached = await semantic_lookup(keys[i], items[i].doctor, embedding)
+        if cached is not None:
+            results[i] = cached
+            cache_kinds[i] = "semantic"
+        else:
+            to_search.append((i, embedding))
+
+    with stage("search"):
+        fetch_ks = [candidate_count(items[i].top_k) for i, _ in to_search]
+        if lexical_only:
+            retrieved = await asyncio.gather(*[
+                search_lexical(items[i].question, items[i].doctor, k)
+                for (i, _), k in zip(to_search, fetch_ks)
+            ], return_exceptions=True)
+        else:
+            retrieved = await retrieve_batch(items, to_search, fetch_ks)
+        if MMR_ENABLED:
+            retrieved = await asyncio.to_thread(lambda: [
+                chunks if isinstance(chunks, Exception) else diversify(chunks, items[i].top_k, MMR_LAMBDA)
+                for (i, _), chunks in zip(to_search, retrieved)
+            ])
+
+    parallelism = min(request.parallelism or BATCH_PARALLELISM, BATCH_MAX_PARALLELISM)
+    semaphore = asyncio.Semaphore(max(1, parallelism))
+
+    async def generate(i, embedding, chunks):
+        item = items[i]
+        chunks = await assemble_context(item.question, chunks, item.max_context_tokens)
+        async with semaphore:
+            answer = await generate_answer(item.question, chunks, item.doctor)
+        result = {"answer": answer, "sources": format_sources(chunks)}
+        await store_answer(keys[i], item.doctor, embedding, result)
         return result
 
+    async def run_item(i, embedding, chunks):
+        try:
+            if isinstance(chunks, Exception):
+                raise chunks
+            results[i] = await inflight.do(
+                keys[i], lambda: generate(i, embedding, chunks)
+            )
+        except Exception as e:
+            results[i] = {"error": str(e)}
+
+    with stage("generate"):
+        await asyncio.gather(*[
+            run_item(i, embedding, chunks)
+            for (i, embedding), chunks in zip(to_search, retrieved)
+        ])
+
+# === Multi-doctor fan-out ===
+# The question is embedded once and every doctor's index is searched
+# concurrently, so latency is the slowest leg rather than the sum of legs.
+# "combined" merges the legs by retrieval score (at most per_doctor_k chunks per
+# doctor, top_k overall) into one panel answer; "per_doctor" generates each
+# doctor's answer concurrently, reusing their per-doctor cache entries.
+@app.post("/ask/fanout")
+async def ask_fanout(request: FanOutRequest):
+    if request.mode not in ("combined", "per_doctor"):
+        raise HTTPException(status_code=400, detail="mode must be 'combined' or 'per_doctor'")
+    if not request.doctors:
+        raise HTTPException(status_code=400, detail="doctors must name at least one doctor")
+    doctors = list(dict.fromkeys(request.doctors))
+    for doctor in doctors:
+        check_doctor(doctor)
+    trace = start_request()
+    doctor_label = ",".join(doctors)
+
+    if request.mode == "per_doctor":
+        answers = await fanout_per_doctor(request, doctors)
+        for doctor, result in answers.items():
+            log_query(
+                trace, "/ask/fanout", doctor, request.question, request.per_doctor_k,
+                answer=result.get("answer"), error=result.get("error"),
+            )
+        return {"answers": answers}
+
+    key = cache_key("panel:" + ",".join(sorted(doctors)), request.question)
+    cached, state = await cache_call(cache.get, key)
+    if cached is not None:
+        if state == STALE:
+            await revalidate(key, doctor_label, partial(fanout_combined, key, request, doctors))
+        trace.cache = "exact"
+        log_query(trace, "/ask/fanout", doctor_label, request.question, request.top_k, cached["answer"])
+        return cached
+
+    try:
+        result = await inflight.do(key, lambda: fanout_combined(key, request, doctors))
+    except Exception as e:
+        log_query(trace, "/ask/fanout", doctor_label, request.question, request.top_k, error=str(e))
+        raise upstream_error(e)
+
+    log_query(trace, "/ask/fanout", doctor_label, request.question, request.top_k, result["answer"])
+    return result
+
+async def search_doctors(query_embedding, doctors, top_k, question=None):
+    legs = await asyncio.gather(
+        *[search_chunks(query_embedding, doctor, top_k, question) for doctor in doctors],
+        return_exceptions=True,
+    )
+    return dict(zip(doctors, legs))
+
+async def fanout_combined(key, request, doctors):
+    with stage("embed"):
+        query_embedding = await embed_query_within_budget(request.question)
+    with stage("search"):
+        legs = await search_doctors(query_embedding, doctors, request.per_doctor_k, request.question)
+
+    errors = {d: str(leg) for d, leg in legs.items() if isinstance(leg, Exception)}
+    if len(errors) == len(doctors):
+        raise Exception(f"All doctor searches failed: {errors}")
+
+    merged = [
+        {**chunk, "doctor": doctor}
+        for doctor, leg in legs.items() if not isinstance(leg, Exception)
+        for chunk in leg[:request.per_doctor_k]
+    ]
+    # Similarities are comparable across doctors; RRF scores only rank within
+    # one doctor's list, so they (or BM25) only order chunks without one
+    merged.sort(key=lambda c: c.get("similarity", c.get("rrf", c.get("bm25", 0.0))), reverse=True)
+    chunks = await assemble_context(request.question, merged[:request.top_k], request.max_context_tokens)
+
+    with stage("generate"):
+        answer = await generate_panel_answer(request.question, chunks)
+    sources = [
+        {"doctor": c["doctor"], **source} for c, source in zip(chunks, format_sources(chunks))
+    ]
+    result = {"answer": answer, "sources": sources}
+    if errors:
+        result["errors"] = errors
+    else:
+        await cache_call(cache.set, key, result)
+    return result
+
+async def fanout_per_doctor(request, doctors):
+    answers = {}
+    pending = []
+    lookups = await cache_call(lambda: [cache.get(cache_key(doctor, request.question)) for doctor in doctors])
+    for doctor, (cached, _) in zip(doctors, lookups):
+        if cached is not None:
+            answers[doctor] = cached
+        else:
+            pending.append(doctor)
+    if not pending:
+        return answers
+
+    try:
+        with stage("embed"):
+            query_embedding = await embed_query_within_budget(request.question)
+    except Exception as e:
+        return {**answers, **{d: {"error": str(e)} for d in pending}}
+
+    async def answer_doctor(doctor):
+        key = cache_key(doctor, request.question)
+        cached = await semantic_lookup(key, doctor, query_embedding)
+        if cached is not None:
+            return cached
+        return await inflight.do(key, lambda: run_and_store(
+            key, request.question, doctor, request.per_doctor_k, query_embedding,
+            request.max_context_tokens,
+        ))
+
+    results = await asyncio.gather(*[answer_doctor(d) for d in pending], return_exceptions=True)
+    for doctor, result in zip(pending, results):
+        answers[doctor] = {"error": str(result)} if isinstance(result, Exception) else result
+    return {d: answers[d] for d in doctors}
+
+async def replay_events(cached):
+    yield sse_event("sources", cached["sources"])
+    yield sse_event("token", cached["answer"])
+    yield sse_event("done", {"answer": cached["answer"], "cached": True})
+
+# === Streaming ask endpoint (Server-Sent Events) ===
+# Events: "sources" once retrieval is done, "token" per generated delta,
+# then "done" with the full answer (or "error" if generation fails).
+@app.post("/ask/stream")
+async def ask_question_stream(request: QuestionRequest):
+    check_doctor(request.doctor)
+    trace = start_request()
+    key = cache_key(request.doctor, request.question)
+
+    def log(answer=None, error=None):
+        log_query(trace, "/ask/stream", request.doctor, request.question, request.top_k, answer, error)
+
+    cached, state = await cache_call(cache.get, key)
+    if cached is not None:
+        if state == STALE:
+            await revalidate(key, request.doctor, partial(refresh_answer, key, request))
+        trace.cache = "exact"
+        log(cached["answer"])
+        return StreamingResponse(replay_events(cached), media_type="text/event-stream")
+
+    try:
+        with stage("embed"):
+            query_embedding = await embed_query_within_budget(request.question)
+        cached = await semantic_lookup(key, request.doctor, query_embedding)
+        if cached is not None:
+            log(cached["answer"])
+            return StreamingResponse(replay_events(cached), media_type="text/event-stream")
+
+        with stage("search"):
+            chunks = await search_chunks(query_embedding, request.doctor, request.top_k, request.question)
+        chunks = await assemble_context(request.question, chunks, request.max_context_tokens)
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        log(error=str(e))
+        raise upstream_error(e)
+
+    sources = format_sources(chunks)
+
+    async def events():
+        yield sse_event("sources", sources)
+
+        parts = []
+        started = time.perf_counter()
+        try:
+            async for token in stream_answer(request.question, chunks, request.doctor):
+                if not parts:
+                    trace.timings["first_token"] = round((time.perf_counter() - started) * 1000, 2)
+                parts.append(token)
+                yield sse_event("token", token)
+        except Exception as e:
+            log(error=str(e))
+            yield sse_event("error", {"detail": str(e)})
+            return
+        trace.timings["generate"] = round((time.perf_counter() - started) * 1000, 2)
+
+        answer = "".join(parts)
+        await store_answer(key, request.doctor, query_embedding, {"answer": answer, "sources": sources})
+        log(answer)
+
+        yield sse_event("done", {"answer": answer, "cached": False})
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
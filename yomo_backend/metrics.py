@@ -0,0 +1,218 @@
+import threading
+from contextlib import contextmanager
+
+# === Hot-path metrics in Prometheus text format ===
+# Plain counters, gauges and fixed-bucket histograms keyed by label tuples.
+# Updates are a dict lookup and a few additions; render() produces the
+# text exposition format served on /metrics.
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names, values):
+    if not names:
+        return ""
+    return "{" + ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, values)) + "}"
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    # For counts kept elsewhere (e.g. by the query log writer) and copied in at render time
+    def set(self, *label_values, value):
+        with self._lock:
+            self.values[label_values] = value
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, _labels(self.labels, k), v) for k, v in self.values.items()]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, *label_values, amount=1):
+        self.inc(*label_values, amount=-amount)
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self.series = {}  # labels -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        with self._lock:
+            series = self.series.get(label_values)
+            if series is None:
+                series = self.series[label_values] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+                    break
+            series[-2] += value
+            series[-1] += 1
+
+    def samples(self):
+        out = []
+        with self._lock:
+            for key, series in self.series.items():
+                cumulative = 0
+                for bound, count in zip(self.buckets, series):
+                    cumulative += count
+                    out.append((
+                        f"{self.name}_bucket",
+                        _labels(self.labels + ("le",), key + (bound,)),
+                        cumulative,
+                    ))
+                out.append((f"{self.name}_bucket", _labels(self.labels + ("le",), key + ("+Inf",)), series[-1]))
+                out.append((f"{self.name}_sum", _labels(self.labels, key), series[-2]))
+                out.append((f"{self.name}_count", _labels(self.labels, key), series[-1]))
+        return out
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{labels} {value}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+request_latency = registry.add(Histogram(
+    "yomo_request_latency_seconds", "End-to-end request latency",
+    ("endpoint", "doctor"),
+))
+stage_latency = registry.add(Histogram(
+    "yomo_stage_latency_seconds", "Latency of each pipeline stage",
+    ("stage", "doctor"),
+))
+requests_total = registry.add(Counter(
+    "yomo_requests_total", "Answered requests by outcome",
+    ("endpoint", "status"),
+))
+cache_lookups = registry.add(Counter(
+    "yomo_cache_lookups_total", "Answer lookups by cache outcome (exact, semantic, miss)",
+    ("result",),
+))
+cache_hit_ratio = registry.add(Gauge(
+    "yomo_cache_hit_ratio", "Share of answer lookups served from a cache",
+))
+upstream_errors = registry.add(Counter(
+    "yomo_upstream_errors_total", "Failed calls to upstream services",
+    ("upstream",),
+))
+upstream_retries = registry.add(Counter(
+    "yomo_upstream_retries_total", "Upstream calls retried after a timeout, 429 or 5xx",
+    ("upstream",),
+))
+circuit_state = registry.add(Gauge(
+    "yomo_circuit_state", "Upstream circuit breaker state (0 closed, 1 half-open, 2 open)",
+    ("upstream",),
+))
+hedged_requests = registry.add(Counter(
+    "yomo_hedged_requests_total", "LLM hedging: duplicates sent, duplicates that won, hedges refused by the rate cap",
+    ("kind", "result"),
+))
+lexical_fallbacks = registry.add(Counter(
+    "yomo_lexical_fallbacks_total", "Retrievals served by BM25 alone because the query embedding was late or failed",
+    ("reason",),
+))
+query_log_written = registry.add(Counter(
+    "yomo_query_log_written_total", "Records written to the query / slow-request logs",
+    ("log",),
+))
+query_log_dropped = registry.add(Counter(
+    "yomo_query_log_dropped_total", "Log records dropped because the writer queue was full or the write failed",
+    ("log",),
+))
+in_flight = registry.add(Gauge(
+    "yomo_in_flight_requests", "Requests currently being handled",
+    ("endpoint",),
+))
+
+
+# timings=None counts the request without observing its latency (batch
+# items, whose shared trace is observed once per batch)
+def observe_request(endpoint, doctor, status, cache_result, timings=None):
+    requests_total.inc(endpoint, status)
+    cache_lookups.inc(cache_result or "miss")
+    if timings is not None:
+        observe_latency(endpoint, doctor, timings)
+
+    counts = dict(cache_lookups.values)
+    hits = sum(v for k, v in counts.items() if k != ("miss",))
+    lookups = sum(counts.values())
+    cache_hit_ratio.set(value=hits / lookups if lookups else 0.0)
+
+
+def observe_latency(endpoint, doctor, timings):
+    for name, ms in timings.items():
+        if name == "total":
+            request_latency.observe(ms / 1000, endpoint, doctor)
+        else:
+            stage_latency.observe(ms / 1000, name, doctor)
+
+
+@contextmanager
+def track_upstream(name):
+    try:
+        yield
+    except Exception:
+        upstream_errors.inc(name)
+        raise
+
+
+# === ASGI middleware: in-flight request gauge per endpoint ===
+# Pure ASGI (not BaseHTTPMiddleware) so streamed responses stay counted
+# until their last byte is sent.
+TRACKED_ENDPOINTS = {"/ask", "/ask/stream", "/ask/batch", "/ask/fanout"}
+
+
+class InFlightMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        path = scope["path"]
+        endpoint = path if path in TRACKED_ENDPOINTS else "other"
+        in_flight.inc(endpoint)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            in_flight.dec(endpoint)
@@ -0,0 +1,90 @@
+import re
+import numpy as np
+
+from ann_index import normalize
+from chunk_store import parse_embedding
+
+# === Maximal marginal relevance over retrieved candidates ===
+# Greedily picks the candidate maximising
+#     lambda * relevance - (1 - lambda) * max similarity to already picked
+# The candidate-by-candidate similarity matrix is one matmul; each greedy
+# step is a vectorized argmax plus an np.maximum update, so selection is
+# O(k * n) array work with no Python loop over candidate pairs.
+#
+# Redundancy uses the candidates' embeddings when retrieval returns them
+# (local indexes) and hashed term-frequency vectors of the text otherwise;
+# near-duplicate paragraphs are near-duplicates under either.
+
+TOKEN_RE = re.compile(r"\w+")
+TEXT_DIM = 1024
+RANK_FIELDS = ("rrf", "bm25")
+
+
+def text_vectors(texts, dim=TEXT_DIM, tokenize=None):
+    # Only compared within one call, so the per-process str hash is enough
+    rows, buckets = [], []
+    for i, text in enumerate(texts):
+        tokens = tokenize(text) if tokenize else TOKEN_RE.findall(text.lower())
+        rows.extend([i] * len(tokens))
+        buckets.extend(hash(token) % dim for token in tokens)
+    flat = np.asarray(rows, dtype=np.int64) * dim + np.asarray(buckets, dtype=np.int64)
+    counts = np.bincount(flat, minlength=len(texts) * dim)
+    return normalize(counts.reshape(len(texts), dim))
+
+
+def relevance_scores(chunks):
+    # Cosine similarity to the query is on the same scale as the redundancy
+    # term, so use it as is. Fused / BM25 scores are not, so min-max scale
+    # them to [0, 1]; plain rank order if there is no score at all.
+    if all("similarity" in c for c in chunks):
+        return np.array([c["similarity"] for c in chunks], dtype=np.float32)
+    for field in RANK_FIELDS:
+        if all(field in c for c in chunks):
+            scores = np.array([c[field] for c in chunks], dtype=np.float32)
+            spread = scores.max() - scores.min()
+            return (scores - scores.min()) / spread if spread > 0 else np.ones(len(chunks), dtype=np.float32)
+    return np.linspace(1.0, 0.0, len(chunks), dtype=np.float32)
+
+
+def mmr_select(relevance, vectors, top_k, lambda_=0.7):
+    n = len(relevance)
+    k = min(top_k, n)
+    if k <= 0:
+        return []
+
+    vectors = normalize(vectors)
+    similarity = vectors @ vectors.T
+    relevance = np.asarray(relevance, dtype=np.float32)
+
+    picked = [int(np.argmax(relevance))]
+    max_similarity = similarity[picked[0]].copy()
+    available = np.ones(n, dtype=bool)
+    available[picked[0]] = False
+
+    while len(picked) < k:
+        scores = lambda_ * relevance - (1 - lambda_) * max_similarity
+        scores[~available] = -np.inf
+        best = int(np.argmax(scores))
+        picked.append(best)
+        available[best] = False
+        np.maximum(max_similarity, similarity[best], out=max_similarity)
+    return picked
+
+
+def diversify(chunks, top_k, lambda_=0.7):
+    if len(chunks) <= top_k:
+        return [strip_embedding(c) for c in chunks]
+
+    if all(c.get("embedding") is not None for c in chunks):
+        vectors = np.stack([np.asarray(parse_embedding(c["embedding"]), dtype=np.float32) for c in chunks])
+    else:
+        vectors = text_vectors([c.get("text", "") for c in chunks])
+
+    picked = mmr_select(relevance_scores(chunks), vectors, top_k, lambda_)
+    return [strip_embedding(chunks[i]) for i in picked]
+
+
+def strip_embedding(chunk):
+    if "embedding" not in chunk:
+        return chunk
+    return {k: v for k, v in chunk.items() if k != "embedding"}
@@ -0,0 +1,229 @@
+import argparse
+import json
+import os
+import time
+import numpy as np
+
+from ann_index import RECORD_FIELDS, normalize
+from chunk_store import ChunkStore, iter_json_rows, parse_embedding, write_chunk_store
+
+# === Quantized in-process index with float rescoring ===
+# Phase 1 scores every chunk with a compact code:
+#   binary  1 bit per dimension (sign), Hamming distance      32x smaller
+#   int8    per-dimension symmetric int8, asymmetric dot       4x smaller
+# Phase 2 rescores the best `top_k * rescore` candidates against the float
+# vectors, which live on disk (a float16 chunk store, memory-mapped) so only
+# the touched rows are paged in. Binary codes are bit-for-bit Cohere's `ubinary`
+# embedding type: sign bits packed most-significant first.
+#
+# Same interface as IVFFlatIndex, so main.py can use either for the local
+# backend (LOCAL_INDEX_QUANTIZATION=int8|binary).
+
+MODES = ("binary", "int8")
+# Candidates per result kept for rescoring; sign bits lose more, so need more
+DEFAULT_RESCORE = {"binary": 10, "int8": 2}
+SCORE_BLOCK = 2048  # int8 rows widened to float32 at a time (cache-sized)
+
+
+def quantize_binary(vectors):
+    return np.packbits(np.asarray(vectors) > 0, axis=-1)
+
+
+def int8_scales(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if len(vectors) == 0:
+        return np.ones(vectors.shape[-1], dtype=np.float32)
+    scales = np.abs(vectors).max(axis=0) / 127.0
+    scales[scales == 0] = 1.0
+    return scales.astype(np.float32)
+
+
+def quantize_int8(vectors, scales):
+    codes = np.rint(np.asarray(vectors, dtype=np.float32) / scales)
+    return np.clip(codes, -127, 127).astype(np.int8)
+
+
+if hasattr(np, "bitwise_count"):
+    def popcount(codes):
+        return np.bitwise_count(codes)
+else:
+    POPCOUNT_TABLE = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+    def popcount(codes):
+        return POPCOUNT_TABLE[codes]
+
+
+def hamming_distances(codes, query_code):
+    return popcount(np.bitwise_xor(codes, query_code)).sum(axis=1, dtype=np.int32)
+
+
+def top_indices(scores, k):
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.zeros(0, dtype=np.int64)
+    best = np.argpartition(-scores, k - 1)[:k]
+    return best[np.argsort(-scores[best])]
+
+
+class QuantizedIndex:
+    def __init__(self, mode="binary", rescore=None):
+        if mode not in MODES:
+            raise ValueError(f"mode must be one of {MODES}")
+        self.mode = mode
+        self.rescore = rescore or DEFAULT_RESCORE[mode]
+        self.codes = None
+        self.scales = None
+        self.vectors = None  # float16, memory-mapped after load()
+        self.records = []
+        self.store = None  # ChunkStore after load(); holds the records instead
+
+    def __len__(self):
+        return len(self.store) if self.store is not None else len(self.records)
+
+    def record(self, row):
+        return self.store.record(row) if self.store is not None else self.records[row]
+
+    def iter_records(self):
+        for row in range(len(self)):
+            yield self.record(row)
+
+    def build(self, embeddings, records):
+        vectors = normalize(embeddings)
+        if self.mode == "binary":
+            self.codes = quantize_binary(vectors)
+        else:
+            self.scales = int8_scales(vectors)
+            self.codes = quantize_int8(vectors, self.scales)
+        self.vectors = vectors.astype(np.float16)
+        self.records = list(records)
+        return self
+
+    def candidate_scores(self, query):
+        if self.mode == "binary":
+            # Higher is better: negate the Hamming distance
+            return -hamming_distances(self.codes, quantize_binary(query)).astype(np.float32)
+
+        # Asymmetric: float query, int8 corpus. NumPy has no int8 BLAS, so
+        # widen one cache-sized block at a time into a reused buffer.
+        weights = query * self.scales
+        scores = np.empty(len(self.codes), dtype=np.float32)
+        buffer = np.empty((min(SCORE_BLOCK, len(self.codes)), self.codes.shape[1]), dtype=np.float32)
+        for start in range(0, len(self.codes), SCORE_BLOCK):
+            block = self.codes[start:start + SCORE_BLOCK]
+            widened = buffer[:len(block)]
+            widened[...] = block
+            np.matmul(widened, weights, out=scores[start:start + len(block)])
+        return scores
+
+    def search(self, query_embedding, top_k=5, rescore=None, with_vectors=False):
+        query = normalize(query_embedding)
+        candidates = top_indices(self.candidate_scores(query), top_k * (rescore or self.rescore))
+        if len(candidates) == 0:
+            return []
+
+        # np.sort keeps memory-mapped reads sequential
+        candidates = np.sort(candidates)
+        scores = self.vectors[candidates].astype(np.float32) @ query
+        best = top_indices(scores, top_k)
+
+        hits = []
+        for i in best:
+            hit = {**self.record(candidates[i]), "similarity": float(scores[i])}
+            if with_vectors:
+                hit["embedding"] = self.vectors[candidates[i]]
+            hits.append(hit)
+        return hits
+
+    def search_batch(self, query_embeddings, top_k=5, rescore=None, with_vectors=False):
+        return [self.search(q, top_k, rescore, with_vectors) for q in query_embeddings]
+
+    # === Persistence: a float16 chunk store (<path>.<mode>/) plus the codes ===
+    @staticmethod
+    def directory(path, mode):
+        return f"{path}.{mode}"
+
+    def save(self, path):
+        directory = self.directory(path, self.mode)
+        write_chunk_store(directory, (
+            {**record, "embedding": vector} for record, vector in zip(self.iter_records(), self.vectors)
+        ), dtype="float16")
+        arrays = {"codes": self.codes, "rescore": self.rescore}
+        if self.scales is not None:
+            arrays["scales"] = self.scales
+        np.savez(os.path.join(directory, "codes.npz"), **arrays)
+
+    @classmethod
+    def load(cls, path, mode="binary", rescore=None):
+        directory = cls.directory(path, mode)
+        with np.load(os.path.join(directory, "codes.npz")) as arrays:
+            index = cls(mode=mode, rescore=rescore or int(arrays["rescore"]))
+            index.codes = arrays["codes"]
+            index.scales = arrays["scales"] if "scales" in arrays else None
+        index.store = ChunkStore(directory)
+        index.vectors = index.store.vectors
+        return index
+
+    @classmethod
+    def exists(cls, path, mode="binary"):
+        directory = cls.directory(path, mode)
+        return ChunkStore.exists(directory) and os.path.exists(os.path.join(directory, "codes.npz"))
+
+    def memory_bytes(self):
+        return self.codes.nbytes + (self.scales.nbytes if self.scales is not None else 0)
+
+
+def build_from_rows(rows, mode="binary", rescore=None):
+    embeddings = [parse_embedding(r["embedding"]) for r in rows]
+    records = [{f: r[f] for f in RECORD_FIELDS if f in r} for r in rows]
+    return QuantizedIndex(mode, rescore).build(embeddings, records)
+
+
+# === Recall vs exact search ===
+# Each query is a corpus vector; its own row is excluded from both result
+# lists so the trivial self-match does not inflate recall.
+def measure_recall(embeddings, n_queries=200, top_k=10, rescore=None, seed=0):
+    vectors = normalize(embeddings)
+    records = [{"row": i} for i in range(len(vectors))]
+    rng = np.random.default_rng(seed)
+    queries = rng.choice(len(vectors), size=min(n_queries, len(vectors)), replace=False)
+
+    exact_scores = vectors[queries] @ vectors.T
+    exact_scores[np.arange(len(queries)), queries] = -np.inf
+    exact = [set(top_indices(row, top_k).tolist()) for row in exact_scores]
+
+    report = {"chunks": len(vectors), "queries": len(queries), "top_k": top_k,
+              "float32_bytes": int(vectors.nbytes)}
+    for mode in MODES:
+        index = QuantizedIndex(mode, rescore).build(vectors, records)
+        hits, total, start = 0, 0, time.perf_counter()
+        for q, truth in zip(queries, exact):
+            found = [r["row"] for r in index.search(vectors[q], top_k + 1) if r["row"] != q][:top_k]
+            hits += len(truth.intersection(found))
+            total += len(truth)
+        report[mode] = {
+            "rescore": index.rescore,
+            "recall": hits / total if total else 1.0,
+            "ms_per_query": (time.perf_counter() - start) * 1000 / max(len(queries), 1),
+            "code_bytes": int(index.memory_bytes()),
+        }
+    return report
+
+
+# === CLI: python quantize.py --json ../Sinclair/sinclair_chunks.json ===
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure quantized-search recall against exact search")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--store", help="Chunk store directory (chunk_store.py)")
+    source.add_argument("--json", help="Chunks JSON / JSON Lines file")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--rescore", type=int, help="Candidates per result for float rescoring (default per mode)")
+    args = parser.parse_args()
+
+    if args.store:
+        with ChunkStore(args.store) as store:
+            embeddings = np.asarray(store.vectors, dtype=np.float32)
+    else:
+        embeddings = [parse_embedding(r["embedding"]) for r in iter_json_rows(args.json)]
+
+    print(json.dumps(measure_recall(embeddings, args.queries, args.top_k, args.rescore), indent=2))
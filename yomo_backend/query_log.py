@@ -0,0 +1,119 @@
+import json
+import os
+import queue
+import threading
+import time
+
+# === Non-blocking structured query log ===
+# Request handlers only enqueue a record; a dedicated writer thread batches
+# records into JSON Lines, flushes, and rotates the file by size
+# (query_log.jsonl → query_log.jsonl.1 → ... → .N). When the queue is full
+# records are dropped and counted rather than blocking the request, as are
+# records whose write fails.
+
+
+class QueryLogger:
+    def __init__(self, path, max_bytes=10 * 1024 * 1024, backups=5,
+                 queue_size=10000, batch_size=256, flush_interval=1.0):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.written = 0
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = None
+        self._stop = threading.Event()
+
+    def log(self, **record):
+        record.setdefault("ts", time.time())
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def start(self):
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="query-log", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=5.0):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join(timeout)
+            self._thread = None
+
+    def stats(self):
+        return {
+            "queued": self._queue.qsize(),
+            "written": self.written,
+            "dropped": self.dropped,
+        }
+
+    def _run(self):
+        # A failed write (disk full, directory removed, ...) drops and counts
+        # that batch and reopens the file for the next one; the writer thread
+        # itself keeps running
+        log_file = None
+        try:
+            while not (self._stop.is_set() and self._queue.empty()):
+                batch = self._next_batch()
+                if not batch:
+                    continue
+                try:
+                    if log_file is None:
+                        log_file = self._open()
+                    log_file.write("".join(
+                        json.dumps(record, ensure_ascii=False, default=str) + "\n" for record in batch
+                    ))
+                    log_file.flush()
+                except OSError as e:
+                    self.dropped += len(batch)
+                    print(f"⚠️ Query log write to {self.path} failed, {len(batch)} records dropped: {e}")
+                    log_file = self._close(log_file)
+                    continue
+                self.written += len(batch)
+                if log_file.tell() >= self.max_bytes:
+                    log_file = self._close(log_file)
+                    try:
+                        self._rotate()
+                    except OSError as e:
+                        print(f"⚠️ Query log rotation of {self.path} failed: {e}")
+        finally:
+            self._close(log_file)
+
+    def _open(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        return open(self.path, "a", encoding="utf-8")
+
+    def _close(self, log_file):
+        if log_file is not None:
+            try:
+                log_file.close()
+            except OSError:
+                pass
+        return None
+
+    def _next_batch(self):
+        try:
+            batch = [self._queue.get(timeout=self.flush_interval)]
+        except queue.Empty:
+            return []
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _rotate(self):
+        for i in range(self.backups - 1, 0, -1):
+            src = f"{self.path}.{i}"
+            if os.path.exists(src):
+                os.replace(src, f"{self.path}.{i + 1}")
+        if self.backups > 0:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
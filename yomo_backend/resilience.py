@@ -0,0 +1,248 @@
+import asyncio
+import os
+import random
+import threading
+import time
+
+# === Upstream call policy: timeouts, bounded retries, circuit breakers ===
+# Shared by the API (httpx, async) and the scripts (requests / cohere, sync).
+#
+# Timeouts: per service, {SERVICE}_CONNECT_TIMEOUT / {SERVICE}_READ_TIMEOUT.
+# Retries: only transport errors and 408/425/429/5xx, which are safe to repeat
+#   for every call we make (reads, embeddings, completions, idempotent
+#   upserts), with full-jitter exponential backoff. Anything else is returned
+#   or raised on the first attempt. LLM completions do not retry read
+#   timeouts (is_retryable_fast).
+# Breakers: one per upstream. FAILURE_THRESHOLD consecutive failed calls
+#   (retries exhausted on timeouts, dropped connections or 5xx) open it;
+#   while open, calls fail fast with CircuitOpenError. After RESET_TIMEOUT
+#   one trial call is let through (half-open): success closes it, failure
+#   reopens.
+
+SERVICES = ("cohere", "supabase", "chutes")
+DEFAULT_TIMEOUTS = {  # (connect, read) seconds
+    "cohere": (3.0, 15.0),
+    "supabase": (3.0, 10.0),
+    "chutes": (5.0, 60.0),
+}
+RETRY_ATTEMPTS = int(os.getenv("UPSTREAM_RETRY_ATTEMPTS", "3"))
+RETRY_BASE_DELAY = float(os.getenv("UPSTREAM_RETRY_BASE_DELAY", "0.2"))
+RETRY_MAX_DELAY = float(os.getenv("UPSTREAM_RETRY_MAX_DELAY", "3"))
+FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5"))
+RESET_TIMEOUT = float(os.getenv("CIRCUIT_RESET_TIMEOUT", "30"))
+
+RETRYABLE_STATUSES = frozenset({408, 425, 429, 500, 502, 503, 504})
+# Exception types without an HTTP status that mean "try again" (matched by
+# name so this module needs neither httpx nor requests)
+TRANSPORT_ERRORS = frozenset({
+    "ConnectError", "ConnectTimeout", "ReadTimeout", "WriteTimeout", "PoolTimeout",
+    "ReadError", "WriteError", "RemoteProtocolError", "NetworkError", "TimeoutException",
+    "ConnectionError", "Timeout", "ChunkedEncodingError",
+})
+# Transport errors that only happen after waiting out a whole read timeout
+READ_TIMEOUT_ERRORS = frozenset({"ReadTimeout", "TimeoutException", "Timeout"})
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+
+def timeouts(service):
+    prefix = service.upper()
+    connect, read = DEFAULT_TIMEOUTS[service]
+    return (
+        float(os.getenv(f"{prefix}_CONNECT_TIMEOUT", connect)),
+        float(os.getenv(f"{prefix}_READ_TIMEOUT", read)),
+    )
+
+
+class CircuitOpenError(Exception):
+    def __init__(self, service, retry_in):
+        super().__init__(f"{service} circuit open; failing fast for another {retry_in:.1f}s")
+        self.service = service
+        self.retry_in = retry_in
+
+
+class UpstreamStatusError(Exception):
+    def __init__(self, service, status_code, body="", headers=None):
+        super().__init__(f"{service} error {status_code}: {body[:500]}")
+        self.service = service
+        self.status_code = status_code
+        self.headers = headers or {}
+
+
+class CircuitBreaker:
+    def __init__(self, name, failure_threshold=FAILURE_THRESHOLD, reset_timeout=RESET_TIMEOUT):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trial_in_flight = False
+        self.opened_count = 0
+        self.rejected = 0
+        self.retries = 0
+        self.lock = threading.Lock()
+
+    def before_call(self):
+        with self.lock:
+            if self.state == CLOSED:
+                return
+            retry_in = self.opened_at + self.reset_timeout - time.monotonic()
+            if self.state == OPEN and retry_in <= 0:
+                self.state = HALF_OPEN
+            if self.state == HALF_OPEN and not self.trial_in_flight:
+                self.trial_in_flight = True
+                return
+            self.rejected += 1
+            raise CircuitOpenError(self.name, max(retry_in, 0.0))
+
+    def record_success(self):
+        with self.lock:
+            self.state = CLOSED
+            self.failures = 0
+            self.trial_in_flight = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            self.trial_in_flight = False
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != OPEN:
+                    self.opened_count += 1
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+
+    def release(self):
+        # The call was cancelled: it says nothing about the upstream's health
+        with self.lock:
+            self.trial_in_flight = False
+
+    def snapshot(self):
+        with self.lock:
+            retry_in = self.opened_at + self.reset_timeout - time.monotonic() if self.state == OPEN else 0.0
+            return {
+                "state": self.state,
+                "consecutive_failures": self.failures,
+                "retry_in": round(max(retry_in, 0.0), 2),
+                "times_opened": self.opened_count,
+                "rejected": self.rejected,
+                "retries": self.retries,
+            }
+
+
+breakers = {service: CircuitBreaker(service) for service in SERVICES}
+
+
+def backoff_delay(attempt, retry_after=None):
+    if retry_after is not None:
+        return min(retry_after, RETRY_MAX_DELAY)
+    return random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt))
+
+
+def status_of(error):
+    # UpstreamStatusError, cohere's ApiError and httpx/requests HTTP errors
+    status = getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    return status
+
+
+def is_retryable(error):
+    status = status_of(error)
+    if status is not None:
+        return status in RETRYABLE_STATUSES
+    # No HTTP status: a connect / read timeout or a dropped connection
+    return isinstance(error, (OSError, TimeoutError)) or type(error).__name__ in TRANSPORT_ERRORS
+
+
+# For calls whose read timeout is long (LLM completions), retrying a read
+# timeout would multiply an already minutes-long wait: only errors that
+# fail fast are retried, and the timeout goes straight to the breaker.
+def is_retryable_fast(error):
+    return is_retryable(error) and type(error).__name__ not in READ_TIMEOUT_ERRORS
+
+
+def retry_after_seconds(error):
+    headers = getattr(error, "headers", None) or getattr(getattr(error, "response", None), "headers", None)
+    try:
+        return float((headers or {}).get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+def check_status(service, response):
+    # Turn a retryable HTTP status into an exception so it counts as a failure
+    if response.status_code in RETRYABLE_STATUSES:
+        raise UpstreamStatusError(service, response.status_code, response.text, response.headers)
+    return response
+
+
+def record_outcome(breaker, error):
+    # Client errors (bad request, not found, ...) say nothing about the
+    # upstream's health, and a 429 asks us to slow down (backoff and
+    # Retry-After handle that), so neither counts against the breaker
+    if error is None or not is_retryable(error):
+        breaker.record_success()
+    elif status_of(error) == 429:
+        breaker.release()
+    else:
+        breaker.record_failure()
+
+
+# The breaker sees one outcome per call, after its retries: errors that a
+# retry absorbs never count toward opening it, and a half-open trial is the
+# whole call, retries included.
+async def call_async(service, fn, attempts=RETRY_ATTEMPTS, on_retry=None, retryable=is_retryable):
+    breaker = breakers[service]
+    breaker.before_call()
+    try:
+        for attempt in range(attempts):
+            try:
+                result = await fn()
+            except Exception as e:
+                if not retryable(e) or attempt == attempts - 1:
+                    raise
+                note_retry(breaker, on_retry)
+                await asyncio.sleep(backoff_delay(attempt, retry_after_seconds(e)))
+            else:
+                breaker.record_success()
+                return result
+    except Exception as e:
+        record_outcome(breaker, e)
+        raise
+    except BaseException:  # cancelled
+        breaker.release()
+        raise
+
+
+def call_sync(service, fn, attempts=RETRY_ATTEMPTS, on_retry=None, retryable=is_retryable):
+    breaker = breakers[service]
+    breaker.before_call()
+    try:
+        for attempt in range(attempts):
+            try:
+                result = fn()
+            except Exception as e:
+                if not retryable(e) or attempt == attempts - 1:
+                    raise
+                note_retry(breaker, on_retry)
+                time.sleep(backoff_delay(attempt, retry_after_seconds(e)))
+            else:
+                breaker.record_success()
+                return result
+    except Exception as e:
+        record_outcome(breaker, e)
+        raise
+    except BaseException:
+        breaker.release()
+        raise
+
+
+def note_retry(breaker, on_retry=None):
+    with breaker.lock:
+        breaker.retries += 1
+    if on_retry is not None:
+        on_retry(breaker.name)
+
+
+def snapshot():
+    return {service: breaker.snapshot() for service, breaker in breakers.items()}
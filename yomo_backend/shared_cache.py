@@ -0,0 +1,242 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from cache import FRESH, STALE
+
+# === Answer cache shared by every worker on the host ===
+# Same interface and semantics as cache.AnswerCache (TTL, stale-while-
+# revalidate, entry and byte bounds), stored in one SQLite file in WAL mode:
+# readers never block, writers are serialized by SQLite, and the cache
+# survives restarts and redeploys that keep the file.
+#
+# Entry and byte totals are kept in a one-row table by triggers, so every
+# write can enforce the bounds in its own transaction (least recently used
+# first, recency tracked to TOUCH_INTERVAL). Writes that must see a
+# consistent view (get_or_set, refresh leases) run under BEGIN IMMEDIATE,
+# which makes them atomic across processes. Hit / miss counters are per
+# process.
+
+DEFAULT_PATH = os.getenv(
+    "ANSWER_CACHE_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "answer_cache.sqlite3"),
+)
+
+# Hits rewrite last_used only when it is older than this, so a hot key costs
+# at most one write per interval; eviction is LRU at this resolution
+TOUCH_INTERVAL = float(os.getenv("ANSWER_CACHE_TOUCH_INTERVAL", "1"))
+# A worker that dies mid-refresh gives up its claim after this long
+REFRESH_LEASE = 300
+
+SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS answers ("
+    " key TEXT PRIMARY KEY,"
+    " value TEXT NOT NULL,"
+    " size INTEGER NOT NULL,"
+    " stored_at REAL NOT NULL,"
+    " ttl REAL,"
+    " last_used REAL NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS answers_last_used ON answers(last_used)",
+    "CREATE TABLE IF NOT EXISTS totals ("
+    " id INTEGER PRIMARY KEY CHECK (id = 0),"
+    " entries INTEGER NOT NULL,"
+    " bytes INTEGER NOT NULL)",
+    "INSERT OR IGNORE INTO totals VALUES (0, 0, 0)",
+    "CREATE TRIGGER IF NOT EXISTS answers_insert AFTER INSERT ON answers BEGIN"
+    " UPDATE totals SET entries = entries + 1, bytes = bytes + NEW.size WHERE id = 0; END",
+    "CREATE TRIGGER IF NOT EXISTS answers_update AFTER UPDATE OF size ON answers BEGIN"
+    " UPDATE totals SET bytes = bytes + NEW.size - OLD.size WHERE id = 0; END",
+    "CREATE TRIGGER IF NOT EXISTS answers_delete AFTER DELETE ON answers BEGIN"
+    " UPDATE totals SET entries = entries - 1, bytes = bytes - OLD.size WHERE id = 0; END",
+    "CREATE TABLE IF NOT EXISTS refreshing ("
+    " key TEXT PRIMARY KEY,"
+    " until REAL NOT NULL)",
+)
+
+
+class SharedAnswerCache:
+    def __init__(self, path=DEFAULT_PATH, max_entries=2048, max_bytes=None, ttl=86400, stale_ttl=3600):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        # Autocommit mode: transactions are opened explicitly below
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        with self._transaction():
+            for statement in SCHEMA:
+                self._conn.execute(statement)
+
+    def __len__(self):
+        with self._lock:
+            return self._totals()[0]
+
+    def __contains__(self, key):
+        return self.get(key, count=False)[0] is not None
+
+    def get(self, key, count=True):
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, stored_at, ttl, last_used FROM answers WHERE key = ?", (key,)
+            ).fetchone()
+            state = self._state(row, now)
+            if state is None:
+                if row is not None:
+                    with self._transaction():
+                        self._conn.execute("DELETE FROM answers WHERE key = ? AND stored_at = ?", (key, row[1]))
+                    self.expirations += 1
+                if count:
+                    self.misses += 1
+                return None, None
+
+            if now - row[3] > TOUCH_INTERVAL:
+                self._conn.execute("UPDATE answers SET last_used = ? WHERE key = ?", (now, key))
+            if count:
+                if state == STALE:
+                    self.stale_hits += 1
+                else:
+                    self.hits += 1
+        return json.loads(row[0]), state
+
+    def set(self, key, value, ttl=None):
+        encoded = json.dumps(value, default=str)
+        size = len(encoded.encode())
+        if self.max_bytes is not None and size > self.max_bytes:
+            return
+        with self._lock, self._transaction():
+            self._store(key, encoded, size, ttl)
+
+    # Atomically: return the live entry if there is one, otherwise store
+    # `value`. Returns (value, stored) where stored says which happened.
+    def get_or_set(self, key, value, ttl=None):
+        encoded = json.dumps(value, default=str)
+        size = len(encoded.encode())
+        with self._lock, self._transaction():
+            row = self._conn.execute(
+                "SELECT value, stored_at, ttl, last_used FROM answers WHERE key = ?", (key,)
+            ).fetchone()
+            if self._state(row, time.time()) is not None:
+                return json.loads(row[0]), False
+            if self.max_bytes is None or size <= self.max_bytes:
+                self._store(key, encoded, size, ttl)
+        return value, True
+
+    def delete(self, key):
+        with self._lock, self._transaction():
+            self._conn.execute("DELETE FROM answers WHERE key = ?", (key,))
+
+    def clear(self):
+        with self._lock, self._transaction():
+            self._conn.execute("DELETE FROM answers")
+            self._conn.execute("DELETE FROM refreshing")
+
+    # Returns True for exactly one caller per stale key, across all workers,
+    # until it is set again (or the lease runs out)
+    def begin_refresh(self, key):
+        now = time.time()
+        with self._lock, self._transaction():
+            row = self._conn.execute("SELECT until FROM refreshing WHERE key = ?", (key,)).fetchone()
+            if row is not None and row[0] > now:
+                return False
+            self._conn.execute(
+                "INSERT OR REPLACE INTO refreshing (key, until) VALUES (?, ?)", (key, now + REFRESH_LEASE)
+            )
+            return True
+
+    def end_refresh(self, key):
+        with self._lock:
+            self._conn.execute("DELETE FROM refreshing WHERE key = ?", (key,))
+
+    def stats(self):
+        with self._lock:
+            entries, size = self._totals()
+            lookups = self.hits + self.stale_hits + self.misses
+            return {
+                "backend": "sqlite",
+                "path": self.path,
+                "entries": entries,
+                "bytes": size,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "stale_hits": self.stale_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "hit_ratio": (self.hits + self.stale_hits) / lookups if lookups else 0.0,
+            }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def _state(self, row, now):
+        if row is None:
+            return None
+        _, stored_at, ttl, _ = row
+        age = now - stored_at
+        if ttl is not None and age > ttl + self.stale_ttl:
+            return None
+        return STALE if ttl is not None and age > ttl else FRESH
+
+    def _totals(self):
+        return self._conn.execute("SELECT entries, bytes FROM totals WHERE id = 0").fetchone()
+
+    # Caller holds the lock and an open transaction
+    def _store(self, key, encoded, size, ttl):
+        now = time.time()
+        self._conn.execute(
+            "INSERT INTO answers (key, value, size, stored_at, ttl, last_used) VALUES (?, ?, ?, ?, ?, ?)"
+            " ON CONFLICT(key) DO UPDATE SET value = excluded.value, size = excluded.size,"
+            " stored_at = excluded.stored_at, ttl = excluded.ttl, last_used = excluded.last_used",
+            (key, encoded, size, now, ttl or self.ttl, now),
+        )
+        self._conn.execute("DELETE FROM refreshing WHERE key = ?", (key,))
+        self._evict()
+
+    def _evict(self):
+        entries, size = self._totals()
+        excess_entries = entries - self.max_entries if self.max_entries is not None else 0
+        excess_bytes = size - self.max_bytes if self.max_bytes is not None else 0
+        if excess_entries <= 0 and excess_bytes <= 0:
+            return
+
+        victims = []
+        for key, row_size in self._conn.execute("SELECT key, size FROM answers ORDER BY last_used"):
+            if excess_entries <= 0 and excess_bytes <= 0:
+                break
+            victims.append((key,))
+            excess_entries -= 1
+            excess_bytes -= row_size
+        self._conn.executemany("DELETE FROM answers WHERE key = ?", victims)
+        self.evictions += len(victims)
+
+    def _transaction(self):
+        return Transaction(self._conn)
+
+
+# BEGIN IMMEDIATE takes the write lock up front, so a read-then-write
+# transaction cannot be interleaved with another process's write
+class Transaction:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        self.conn.execute("BEGIN IMMEDIATE")
+        return self.conn
+
+    def __exit__(self, exc_type, *exc):
+        self.conn.execute("COMMIT" if exc_type is None else "ROLLBACK")
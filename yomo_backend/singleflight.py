@@ -0,0 +1,33 @@
+import asyncio
+
+# === Single-flight request coalescing ===
+# Concurrent calls with the same key share one running task. The task is
+# shielded from any single caller's cancellation (a client disconnecting
+# must not fail everyone else), its result or exception is delivered to
+# every waiter, and the key is released as soon as the task finishes.
+
+
+class SingleFlight:
+    def __init__(self):
+        self._tasks = {}
+        self.coalesced = 0
+
+    def __len__(self):
+        return len(self._tasks)
+
+    async def do(self, key, fn):
+        task = self._tasks.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._tasks[key] = task
+            task.add_done_callback(lambda t: self._release(key, t))
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
+
+    def _release(self, key, task):
+        if self._tasks.get(key) is task:
+            del self._tasks[key]
+        # Mark the exception as retrieved even if every waiter went away
+        if not task.cancelled():
+            task.exception()
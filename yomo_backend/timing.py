@@ -0,0 +1,44 @@
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# === Per-request trace: stage timings and cache outcome ===
+# start_request() binds a fresh trace to the current context; stage() adds the
+# elapsed milliseconds of its block under the given name. Tasks spawned from
+# the request (e.g. single-flight leaders) inherit the same trace object.
+
+current_trace = ContextVar("current_trace", default=None)
+
+
+class RequestTrace:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.timings = {}
+        self.cache = None  # None (miss), "exact" or "semantic"
+
+    def total_ms(self):
+        return round((time.perf_counter() - self.started) * 1000, 2)
+
+
+def start_request():
+    trace = RequestTrace()
+    current_trace.set(trace)
+    return trace
+
+
+def note_cache(kind):
+    trace = current_trace.get()
+    if trace is not None:
+        trace.cache = kind
+
+
+@contextmanager
+def stage(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace = current_trace.get()
+        if trace is not None:
+            elapsed = (time.perf_counter() - start) * 1000
+            trace.timings[name] = round(trace.timings.get(name, 0.0) + elapsed, 2)
@@ -0,0 +1,35 @@
+from functools import lru_cache
+
+# === Token counting for prompt budgets ===
+# cl100k_base is a close proxy for DeepSeek's tokenizer. Where tiktoken or
+# its encoding file is unavailable, fall back to ~4 UTF-8 bytes per token,
+# which is what budgets are tuned against anyway.
+
+BYTES_PER_TOKEN = 4
+
+
+@lru_cache(maxsize=None)
+def encoder():
+    try:
+        import tiktoken
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception:
+        return None
+
+
+def estimate_tokens(text):
+    return -(-len(text.encode("utf-8")) // BYTES_PER_TOKEN)
+
+
+def count_tokens(text):
+    enc = encoder()
+    if enc is None:
+        return estimate_tokens(text)
+    return len(enc.encode(text, disallowed_special=()))
+
+
+def count_tokens_batch(texts):
+    enc = encoder()
+    if enc is None:
+        return [estimate_tokens(t) for t in texts]
+    return [len(tokens) for tokens in enc.encode_batch(texts, disallowed_special=())]
@@ -0,0 +1,94 @@
+import os
+import threading
+import httpx
+from resilience import timeouts
+
+# === Connection pool settings ===
+# Defaults apply to every upstream; override per service with
+# COHERE_MAX_CONNECTIONS, SUPABASE_MAX_KEEPALIVE, CHUTES_MAX_CONNECTIONS, ...
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "200"))
+HTTP_MAX_KEEPALIVE = int(os.getenv("HTTP_MAX_KEEPALIVE", "50"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "60"))
+
+# Point Cohere at another host (e.g. the local stand-ins in bench/)
+COHERE_BASE_URL = os.getenv("COHERE_BASE_URL")
+
+
+def pool_limits(service):
+    prefix = service.upper()
+    return httpx.Limits(
+        max_connections=int(os.getenv(f"{prefix}_MAX_CONNECTIONS", HTTP_MAX_CONNECTIONS)),
+        max_keepalive_connections=int(os.getenv(f"{prefix}_MAX_KEEPALIVE", HTTP_MAX_KEEPALIVE)),
+        keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+    )
+
+
+# Connect and read timeouts per service (COHERE_CONNECT_TIMEOUT, CHUTES_READ_TIMEOUT, ...)
+def pool_timeout(service):
+    connect, read = timeouts(service)
+    return httpx.Timeout(read, connect=connect)
+
+
+# === Long-lived clients, opened at app startup and closed at shutdown ===
+# The Cohere SDK imports its generated types when the first client is built
+# (~300 ms), so that client is built on first use - normally by the warm-up,
+# in a worker thread - instead of on the startup path.
+class Upstreams:
+    def __init__(self):
+        self.supabase = None
+        self.chutes = None
+        self._cohere = None
+        self._cohere_http = None
+        self._cohere_key = None
+        self._cohere_lock = threading.Lock()
+
+    @property
+    def cohere(self):
+        if self._cohere is None:
+            with self._cohere_lock:
+                if self._cohere is None:
+                    import cohere
+
+                    self._cohere = cohere.AsyncClient(
+                        self._cohere_key,
+                        httpx_client=self._cohere_http,
+                        max_retries=0,  # retries go through resilience.call_async
+                        **({"base_url": COHERE_BASE_URL} if COHERE_BASE_URL else {}),
+                    )
+        return self._cohere
+
+    async def open(self, cohere_key, supabase_url, supabase_key, chutes_api_key):
+        self._cohere_http = httpx.AsyncClient(
+            limits=pool_limits("cohere"),
+            timeout=pool_timeout("cohere"),
+        )
+        self._cohere_key = cohere_key
+
+        self.supabase = httpx.AsyncClient(
+            base_url=supabase_url or "",
+            headers={
+                "apikey": supabase_key or "",
+                "Authorization": f"Bearer {supabase_key}",
+                "Content-Type": "application/json",
+            },
+            limits=pool_limits("supabase"),
+            timeout=pool_timeout("supabase"),
+        )
+
+        self.chutes = httpx.AsyncClient(
+            headers={
+                "Content-Type": "application/json",
+                "Authorization": f"Bearer {chutes_api_key}",
+            },
+            limits=pool_limits("chutes"),
+            timeout=pool_timeout("chutes"),
+        )
+
+    async def close(self):
+        for client in (self._cohere_http, self.supabase, self.chutes):
+            if client is not None:
+                await client.aclose()
+        self._cohere = self.supabase = self.chutes = self._cohere_http = None
+
+
+clients = Upstreams()
@@ -0,0 +1,61 @@
+import asyncio
+import time
+
+# === Startup warm-up and readiness ===
+# Steps run concurrently in the background once the app is serving, so
+# /health (liveness) answers at once while /ready stays 503 until every step
+# has finished. A failed step is logged and reported, not fatal: the lazy
+# paths still work, the first request that needs them just pays for it.
+
+
+class WarmUp:
+    def __init__(self, started=None):
+        self.started = started if started is not None else time.perf_counter()
+        self.import_ms = None
+        self.warmup_started = None
+        self.finished = None
+        self.steps = {}  # name -> ms
+        self.errors = {}
+        self.task = None
+
+    @property
+    def ready(self):
+        return self.finished is not None
+
+    def start(self, steps):
+        # steps: name -> zero-argument coroutine function
+        self.warmup_started = time.perf_counter()
+        self.import_ms = round((self.warmup_started - self.started) * 1000, 2)
+        self.task = asyncio.ensure_future(self.run(steps))
+        return self.task
+
+    async def run(self, steps):
+        await asyncio.gather(*[self.step(name, fn) for name, fn in steps.items()])
+        self.finished = time.perf_counter()
+        failed = f", {len(self.errors)} failed" if self.errors else ""
+        print(f"✅ Ready in {(self.finished - self.started) * 1000:.0f} ms "
+              f"(import {self.import_ms:.0f} ms, warm-up {(self.finished - self.warmup_started) * 1000:.0f} ms{failed})")
+
+    async def step(self, name, fn):
+        start = time.perf_counter()
+        try:
+            await fn()
+        except Exception as e:
+            self.errors[name] = str(e)
+            print(f"⚠️ Warm-up step {name} failed: {e}")
+        self.steps[name] = round((time.perf_counter() - start) * 1000, 2)
+
+    async def stop(self):
+        if self.task is not None and not self.task.done():
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+
+    def status(self):
+        end = self.finished or time.perf_counter()
+        return {
+            "status": "ready" if self.ready else "warming",
+            "import_ms": self.import_ms,
+            "warmup_ms": round((end - self.warmup_started) * 1000, 2) if self.warmup_started else None,
+            "steps": dict(sorted(self.steps.items())),
+            "errors": self.errors,
+        }